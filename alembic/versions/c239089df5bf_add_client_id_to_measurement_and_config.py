@@ -0,0 +1,30 @@
+"""Add client_id to measurement and config tables
+
+Revision ID: c239089df5bf
+Revises: 9bbe88895bca
+Create Date: 2026-10-19 09:12:41.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c239089df5bf'
+down_revision: Union[str, None] = '9bbe88895bca'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('config', sa.Column('client_id', sa.String, nullable=True, unique=True))
+    op.add_column('measurement', sa.Column('client_id', sa.String, nullable=True, unique=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('measurement', 'client_id')
+    op.drop_column('config', 'client_id')
@@ -0,0 +1,364 @@
+"""
+Cold-data tiering for measurements.
+
+Measurements older than a configurable age are moved out of PostgreSQL into
+date-partitioned Parquet files on local disk. Snapshots are stored next to the
+Parquet files as separate blob files so the columnar files stay small. The read
+helpers in this module let the API fall back to the archive transparently.
+
+Layout of ARCHIVE_DIR:
+    measurement/created_date=YYYY-MM-DD/part-<first_id>-<last_id>.parquet
+    snapshots/<measurement_id>_rgb.b64
+    snapshots/<measurement_id>_hsi.b64
+
+Run the archival job with:
+    python archive.py
+"""
+import asyncio
+import os
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import suppress
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from arrow_format import MEASUREMENT_SCHEMA
+from settings import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+
+ARCHIVE_SCHEMA = MEASUREMENT_SCHEMA
+
+SNAPSHOT_COLUMNS = {"snapshot_rgb_camera": "rgb", "snapshot_hsi_camera": "hsi"}
+
+PARTITIONING = ds.partitioning(pa.schema([("created_date", pa.date32())]), flavor="hive")
+
+# Files written before a column was added to ARCHIVE_SCHEMA lack it; reading the
+# dataset with the full schema fills such columns with nulls
+DATASET_SCHEMA = ARCHIVE_SCHEMA.append(pa.field("created_date", pa.date32()))
+
+
+# Parquet files are named after the first and last measurement id they hold
+PART_FILE_NAME = re.compile(r"part-(\d+)-(\d+)\.parquet")
+
+
+def _measurement_dir(archive_dir: str) -> str:
+    return os.path.join(archive_dir, "measurement")
+
+
+def _snapshot_dir(archive_dir: str) -> str:
+    return os.path.join(archive_dir, "snapshots")
+
+
+def _replace_atomically(path: str, write):
+    """
+    Write a file through a temporary file in the same directory and move it into place.
+
+    Readers see either no file or the complete file, never a partially written one. The
+    temporary file name starts with a dot, so dataset discovery skips it.
+
+    Args:
+        path (str): The final path.
+        write (Callable[[str], None]): Writes the content to the path it is given.
+    """
+    directory, name = os.path.split(path)
+    temporary_path = os.path.join(directory, f".{name}.{uuid4().hex}.tmp")
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(temporary_path)
+        raise
+
+
+def _write_text(path: str, data: str):
+    with open(path, "w") as blob:
+        blob.write(data)
+
+
+def _write_snapshot(archive_dir: str, measurement_id: int, kind: str, data: str | None) -> str | None:
+    """
+    Write a single snapshot to its blob file.
+
+    Returns:
+        str | None: The blob path relative to the archive directory, or None if there is no snapshot.
+    """
+    if data is None:
+        return None
+    relative_path = os.path.join("snapshots", f"{measurement_id}_{kind}.b64")
+    _replace_atomically(os.path.join(archive_dir, relative_path), lambda path: _write_text(path, data))
+    return relative_path
+
+
+def _read_snapshot(archive_dir: str, relative_path: str | None) -> str | None:
+    if relative_path is None:
+        return None
+    with open(os.path.join(archive_dir, relative_path)) as blob:
+        return blob.read()
+
+
+def write_archive_batch(rows: list[dict], archive_dir: str = ARCHIVE_DIR) -> list[str]:
+    """
+    Write a batch of measurement rows to date-partitioned Parquet files.
+
+    Snapshot columns are replaced by paths to blob files holding the snapshot data.
+    Every file is written to a temporary file and renamed into place, so a crash never
+    leaves a truncated file behind.
+
+    Args:
+        rows (list[dict]): Measurement rows as returned from the database.
+        archive_dir (str): Root directory of the archive.
+
+    Returns:
+        list[str]: Paths of the Parquet files that were written.
+    """
+    os.makedirs(_snapshot_dir(archive_dir), exist_ok=True)
+    partitions = defaultdict(list)
+    for row in rows:
+        archived = dict(row)
+        for column, kind in SNAPSHOT_COLUMNS.items():
+            archived[column] = _write_snapshot(archive_dir, row["id"], kind, row.get(column))
+        partitions[row["created_at"].date()].append(archived)
+
+    written = []
+    for created_date, partition_rows in sorted(partitions.items()):
+        partition_dir = os.path.join(_measurement_dir(archive_dir), f"created_date={created_date.isoformat()}")
+        os.makedirs(partition_dir, exist_ok=True)
+        ids = [row["id"] for row in partition_rows]
+        path = os.path.join(partition_dir, f"part-{min(ids)}-{max(ids)}.parquet")
+        table = pa.Table.from_pylist(partition_rows, schema=ARCHIVE_SCHEMA)
+        _replace_atomically(path, lambda temporary_path: pq.write_table(table, temporary_path))
+        written.append(path)
+    return written
+
+
+async def archive_measurements(
+    session: AsyncSession,
+    older_than: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS),
+    archive_dir: str = ARCHIVE_DIR,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """
+    Move measurements older than the given age from PostgreSQL to the Parquet archive.
+
+    Rows are processed in batches: each batch is written to disk first and only then
+    deleted from the database, so a failure never loses data.
+
+    Args:
+        session (AsyncSession): The database session.
+        older_than (timedelta): Minimum age of measurements to archive.
+        archive_dir (str): Root directory of the archive.
+        batch_size (int): Number of rows moved per batch.
+
+    Returns:
+        int: The number of archived measurements.
+    """
+    cutoff = datetime.now() - older_than
+    archived = 0
+    while True:
+        result = await session.execute(text("""
+            SELECT * FROM measurement
+            WHERE created_at < :cutoff
+            ORDER BY id
+            LIMIT :batch_size
+        """), {"cutoff": cutoff, "batch_size": batch_size})
+        rows = [dict(row._mapping) for row in result.fetchall()]
+        if not rows:
+            return archived
+        await asyncio.to_thread(write_archive_batch, rows, archive_dir)
+        await session.execute(
+            text("DELETE FROM measurement WHERE id = ANY(:ids)"),
+            {"ids": [row["id"] for row in rows]}
+        )
+        await session.commit()
+        archived += len(rows)
+
+
+def _archive_files_for_ids(archive_dir: str, ids: list[int]) -> list[str]:
+    """
+    List the Parquet files whose id range, taken from the file name, contains one of the ids.
+
+    Only directories are listed, no file is opened.
+    """
+    ids = sorted(ids)
+    files = []
+    for partition in os.scandir(_measurement_dir(archive_dir)):
+        if not partition.is_dir():
+            continue
+        for entry in os.scandir(partition.path):
+            match = PART_FILE_NAME.fullmatch(entry.name)
+            if match is None:
+                continue
+            first_id, last_id = int(match[1]), int(match[2])
+            position = bisect_left(ids, first_id)
+            if position < len(ids) and ids[position] <= last_id:
+                files.append(entry.path)
+    return files
+
+
+def _read_archive_table(filter_expression, archive_dir: str, columns: list[str],
+                        ids: list[int] | None = None) -> pa.Table | None:
+    """
+    Read matching rows from the archive.
+
+    If ids is given, only files whose id range may hold one of them are opened.
+    """
+    if not os.path.isdir(_measurement_dir(archive_dir)):
+        return None
+    source = _measurement_dir(archive_dir)
+    if ids is not None:
+        source = _archive_files_for_ids(archive_dir, ids)
+        if not source:
+            return None
+    dataset = ds.dataset(
+        source, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING,
+        partition_base_dir=_measurement_dir(archive_dir)
+    )
+    return dataset.to_table(columns=columns, filter=filter_expression)
+
+
+def load_archived_snapshots(rows: list[dict], archive_dir: str = ARCHIVE_DIR) -> list[dict]:
+    """
+    Replace the snapshot blob paths of archived rows by the snapshot data, in place.
+
+    Args:
+        rows (list[dict]): Archived measurements read with with_snapshots=False.
+        archive_dir (str): Root directory of the archive.
+
+    Returns:
+        list[dict]: The same rows.
+    """
+    for row in rows:
+        for column in SNAPSHOT_COLUMNS:
+            row[column] = _read_snapshot(archive_dir, row[column])
+    return rows
+
+
+def _read_archive(filter_expression, archive_dir: str, with_snapshots: bool = True,
+                  ids: list[int] | None = None) -> list[dict]:
+    table = _read_archive_table(filter_expression, archive_dir, ARCHIVE_SCHEMA.names, ids)
+    if table is None:
+        return []
+    rows = table.sort_by("id").to_pylist()
+    return load_archived_snapshots(rows, archive_dir) if with_snapshots else rows
+
+
+def _created_at_filter(filter_expression, created_from: datetime | None, created_before: datetime | None):
+    if created_from is not None:
+        filter_expression &= ds.field("created_date") >= pa.scalar(created_from.date(), type=pa.date32())
+        filter_expression &= ds.field("created_at") >= pa.scalar(created_from, type=pa.timestamp("us"))
+    if created_before is not None:
+        filter_expression &= ds.field("created_date") <= pa.scalar(created_before.date(), type=pa.date32())
+        filter_expression &= ds.field("created_at") < pa.scalar(created_before, type=pa.timestamp("us"))
+    return filter_expression
+
+
+def read_archived_measurement_by_id(measurement_id: int, archive_dir: str = ARCHIVE_DIR) -> dict | None:
+    """
+    Look up a single archived measurement by its ID.
+
+    Only the Parquet files whose id range, encoded in their names, contains the ID are
+    opened, so a miss does not read the archive.
+
+    Args:
+        measurement_id (int): The ID of the measurement.
+        archive_dir (str): Root directory of the archive.
+
+    Returns:
+        dict | None: The archived measurement, or None if it is not in the archive.
+    """
+    rows = _read_archive(ds.field("id") == measurement_id, archive_dir, ids=[measurement_id])
+    return rows[0] if rows else None
+
+
+def read_archived_measurements_by_ids(measurement_ids: list[int], archive_dir: str = ARCHIVE_DIR) -> list[dict]:
+    """
+    Look up several archived measurements by their IDs.
+
+    Like read_archived_measurement_by_id(), only files that may hold one of the IDs are opened.
+
+    Args:
+        measurement_ids (list[int]): The IDs of the measurements.
+        archive_dir (str): Root directory of the archive.
+
+    Returns:
+        list[dict]: The archived measurements that were found, ordered by ID.
+    """
+    if not measurement_ids:
+        return []
+    return _read_archive(ds.field("id").isin(measurement_ids), archive_dir, ids=measurement_ids)
+
+
+def read_archived_measurements_by_config_id(
+    config_id: int,
+    created_before: datetime | None = None,
+    archive_dir: str = ARCHIVE_DIR,
+    with_snapshots: bool = True,
+) -> list[dict]:
+    """
+    Look up archived measurements for a configuration.
+
+    The filter on config_id and created_at is pushed down to the Parquet reader,
+    so partitions and row groups that cannot match are skipped.
+
+    Args:
+        config_id (int): The ID of the configuration.
+        created_before (datetime, optional): Only return measurements created before this time.
+        archive_dir (str): Root directory of the archive.
+        with_snapshots (bool): If False, snapshot columns hold blob paths; pass the rows that
+            are actually returned to load_archived_snapshots() later.
+
+    Returns:
+        list[dict]: The archived measurements ordered by ID.
+    """
+    filter_expression = _created_at_filter(ds.field("config_id") == config_id, None, created_before)
+    return _read_archive(filter_expression, archive_dir, with_snapshots)
+
+
+def read_archived_series(
+    config_id: int,
+    created_from: datetime | None = None,
+    created_before: datetime | None = None,
+    archive_dir: str = ARCHIVE_DIR,
+) -> pa.Table:
+    """
+    Read the acoustic series of a configuration from the archive.
+
+    Only the created_at and acustic columns are read and snapshots are never loaded.
+
+    Args:
+        config_id (int): The ID of the configuration.
+        created_from (datetime, optional): Only return measurements created at or after this time.
+        created_before (datetime, optional): Only return measurements created before this time.
+        archive_dir (str): Root directory of the archive.
+
+    Returns:
+        pa.Table: A table with created_at and acustic columns ordered by created_at.
+    """
+    filter_expression = (ds.field("config_id") == config_id) & ds.field("acustic").is_valid()
+    filter_expression = _created_at_filter(filter_expression, created_from, created_before)
+    columns = ["created_at", "acustic"]
+    table = _read_archive_table(filter_expression, archive_dir, columns)
+    if table is None:
+        return pa.table({name: pa.array([], type=ARCHIVE_SCHEMA.field(name).type) for name in columns})
+    return table.sort_by("created_at")
+
+
+async def main():
+    from main import dispose_engine, get_session
+
+    SessionLocal = get_session()
+    async with SessionLocal() as session:
+        archived = await archive_measurements(session)
+    await dispose_engine()
+    print(f"Archived {archived} measurements to {ARCHIVE_DIR}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
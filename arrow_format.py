@@ -0,0 +1,139 @@
+"""
+Apache Arrow IPC stream responses for analytics clients.
+
+List endpoints return Arrow record batches instead of JSON when the client sends
+`Accept: application/vnd.apache.arrow.stream`. Rows are fetched from the database
+in chunks through a server-side cursor and each chunk is turned into one record
+batch column by column, without building a dict per row.
+"""
+import asyncio
+import io
+from collections.abc import AsyncIterator, Callable, Sequence
+
+import pyarrow as pa
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cancellation import close_session
+from settings import ARROW_BATCH_SIZE
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+MEASUREMENT_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("client_id", pa.string()),
+    ("snapshot_rgb_camera", pa.string()),
+    ("snapshot_hsi_camera", pa.string()),
+    ("acustic", pa.int64()),
+    ("config_id", pa.int64()),
+    ("created_at", pa.timestamp("us")),
+])
+
+
+def wants_arrow(accept: str | None) -> bool:
+    """
+    Check whether the Accept header asks for an Arrow IPC stream.
+
+    Args:
+        accept (str, optional): The value of the Accept header.
+
+    Returns:
+        bool: True if the client accepts the Arrow stream media type.
+    """
+    return accept is not None and ARROW_STREAM_MEDIA_TYPE in accept
+
+
+def select_columns(schema: pa.Schema) -> str:
+    """
+    Return the column list for a SELECT producing rows in schema order.
+    """
+    return ", ".join(schema.names)
+
+
+def record_batch(rows: Sequence[Sequence], schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Build a record batch from rows whose values are in schema order.
+
+    Args:
+        rows (Sequence[Sequence]): Database rows, e.g. one chunk of a result.
+        schema (pa.Schema): The schema of the batch.
+
+    Returns:
+        pa.RecordBatch: The rows as a columnar batch.
+    """
+    columns = zip(*rows) if rows else [[] for _ in schema]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+async def _ipc_stream(batches: AsyncIterator[pa.RecordBatch], schema: pa.Schema) -> AsyncIterator[bytes]:
+    buffer = io.BytesIO()
+    writer = pa.ipc.new_stream(buffer, schema)
+
+    def drain() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    async for batch in batches:
+        writer.write_batch(batch)
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+async def arrow_response(session: AsyncSession, statement, params: dict, schema: pa.Schema,
+                         leading_rows: list[dict] | None = None,
+                         prepare_leading_rows: Callable[[list[dict]], list[dict]] | None = None,
+                         not_found: JSONResponse | None = None,
+                         batch_size: int = ARROW_BATCH_SIZE):
+    """
+    Stream the result of a query as an Arrow IPC stream.
+
+    The query must run on its own session, since the request's session is closed before
+    a streaming response body is sent. The session is closed once the stream ends or
+    the client disconnects.
+
+    Args:
+        session (AsyncSession): The session running the query.
+        statement: The SELECT statement; its columns must be in schema order.
+        params (dict): Parameters of the statement.
+        schema (pa.Schema): Schema of the record batches.
+        leading_rows (list[dict], optional): Rows sent before the query result, e.g. from the archive.
+        prepare_leading_rows (Callable, optional): Blocking function applied to each batch of
+            leading rows in a worker thread right before it is sent, e.g. to load snapshots.
+        not_found (JSONResponse, optional): Returned instead of a stream if there are no rows.
+        batch_size (int): Number of database rows per record batch.
+
+    Returns:
+        StreamingResponse | JSONResponse: The Arrow stream, or not_found if there are no rows.
+    """
+    try:
+        result = await session.stream(statement, params)
+        chunks = result.partitions(batch_size)
+        first_chunk = await anext(chunks, None)
+    except BaseException:
+        await close_session(session)
+        raise
+    if first_chunk is None and not leading_rows and not_found is not None:
+        await close_session(session)
+        return not_found
+
+    async def batches() -> AsyncIterator[pa.RecordBatch]:
+        try:
+            for start in range(0, len(leading_rows or []), batch_size):
+                rows = leading_rows[start:start + batch_size]
+                if prepare_leading_rows is not None:
+                    rows = await asyncio.to_thread(prepare_leading_rows, rows)
+                yield pa.RecordBatch.from_pylist(rows, schema=schema)
+            if first_chunk is not None:
+                yield record_batch(first_chunk, schema)
+                async for chunk in chunks:
+                    yield record_batch(chunk, schema)
+        finally:
+            await close_session(session)
+
+    return StreamingResponse(_ipc_stream(batches(), schema), media_type=ARROW_STREAM_MEDIA_TYPE)
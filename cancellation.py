@@ -0,0 +1,121 @@
+"""
+Statement timeouts and query cancellation.
+
+Every database session opened for a request gets a PostgreSQL statement_timeout,
+configured per endpoint, so no query can run unbounded. GET requests are additionally
+cancelled as soon as the client disconnects: cancelling the handler task interrupts the
+in-flight asyncpg query, which asks the server to cancel it, and the session is then
+closed under a shielded cancel scope so its connection goes back to the pool.
+"""
+import anyio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from settings import STATEMENT_TIMEOUT_MS, STATEMENT_TIMEOUTS_MS
+
+
+def statement_timeout_for(endpoint: str | None) -> int:
+    """
+    Return the statement timeout for an endpoint.
+
+    Args:
+        endpoint (str, optional): The name of the endpoint function.
+
+    Returns:
+        int: The timeout in milliseconds, 0 meaning no timeout.
+    """
+    return STATEMENT_TIMEOUTS_MS.get(endpoint, STATEMENT_TIMEOUT_MS)
+
+
+def with_statement_timeout(session: AsyncSession, timeout_ms: int) -> AsyncSession:
+    """
+    Apply a statement timeout to every transaction of a session.
+
+    The timeout is set with SET LOCAL when a transaction begins, so it never leaks
+    to other users of the pooled connection.
+
+    Args:
+        session (AsyncSession): The session.
+        timeout_ms (int): The timeout in milliseconds, 0 to leave the server default.
+
+    Returns:
+        AsyncSession: The same session.
+    """
+    if timeout_ms:
+        @event.listens_for(session.sync_session, "after_begin")
+        def set_statement_timeout(sync_session, transaction, connection):
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+    return session
+
+
+async def close_session(session: AsyncSession):
+    """
+    Close a session even while the surrounding task is being cancelled.
+
+    Args:
+        session (AsyncSession): The session to close.
+    """
+    with anyio.CancelScope(shield=True):
+        await session.close()
+
+
+def _single_exception(group: BaseExceptionGroup) -> BaseException:
+    while isinstance(group, BaseExceptionGroup) and len(group.exceptions) == 1:
+        group = group.exceptions[0]
+    return group
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    ASGI middleware cancelling GET requests whose client has disconnected.
+
+    The middleware listens for `http.disconnect` while the request is handled and
+    cancels the handler if it arrives before the response is complete. Messages are
+    passed on to the application, so streaming responses keep working as before.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        messages_in, messages_out = anyio.create_memory_object_stream(max_buffer_size=16)
+        response_complete = False
+
+        async def send_and_track(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        async def receive_forwarded():
+            try:
+                return await messages_out.receive()
+            except anyio.EndOfStream:
+                return {"type": "http.disconnect"}
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                async def watch_disconnect():
+                    async with messages_in:
+                        while True:
+                            message = await receive()
+                            await messages_in.send(message)
+                            if message["type"] == "http.disconnect":
+                                if not response_complete:
+                                    task_group.cancel_scope.cancel()
+                                return
+
+                task_group.start_soon(watch_disconnect)
+                await self.app(scope, receive_forwarded, send_and_track)
+                task_group.cancel_scope.cancel()
+        except BaseExceptionGroup as group:
+            # The task group wraps errors of the application in an exception group,
+            # outer middlewares and the server expect the error itself
+            error = _single_exception(group)
+            if error is group:
+                raise
+            raise error from None
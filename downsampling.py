@@ -0,0 +1,134 @@
+"""
+Downsampling of measurement series for plotting.
+
+Both algorithms take the full series as NumPy arrays and return the indices of the
+points to keep, in time order, so any number of parallel arrays can be reduced the
+same way.
+
+* lttb: Largest-Triangle-Three-Buckets keeps the shape of the curve and is the
+  better default for line charts.
+* minmax: keeps the minimum and maximum of each bucket, so spikes are never lost,
+  which suits charts with one bucket per pixel column.
+"""
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Select points with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are always kept. The rest of the series is split into
+    points - 2 buckets and from each bucket the point forming the largest triangle with
+    the previously selected point and the average of the next bucket is kept.
+
+    Args:
+        x (np.ndarray): Monotonically increasing x values, e.g. timestamps as seconds.
+        y (np.ndarray): The y values.
+        points (int): The number of points to keep.
+
+    Returns:
+        np.ndarray: Indices of the selected points in ascending order.
+    """
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    # Average of every bucket, plus the last point acting as the bucket after the last one
+    counts = np.diff(np.append(edges, size))
+    averages_x = np.add.reduceat(x, edges) / counts
+    averages_y = np.add.reduceat(y, edges) / counts
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = averages_x[bucket + 1], averages_y[bucket + 1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax(y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Select the minimum and maximum of points // 2 equally sized buckets.
+
+    Args:
+        y (np.ndarray): The y values.
+        points (int): The maximum number of points to keep.
+
+    Returns:
+        np.ndarray: Indices of the selected points in ascending order.
+    """
+    size = len(y)
+    if points >= size:
+        return np.arange(size)
+
+    buckets = max(points // 2, 1)
+    bucket = np.arange(size) * buckets // size
+    # Sort by bucket, then by value: the first index of each bucket is its minimum, the last its maximum
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    ends = np.append(starts[1:], size) - 1
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def downsample(created_at: np.ndarray, values: np.ndarray, points: int, method: str = "lttb") -> np.ndarray:
+    """
+    Select the indices of a time series to keep for plotting.
+
+    Args:
+        created_at (np.ndarray): Timestamps as datetime64 values in ascending order.
+        values (np.ndarray): The measured values.
+        points (int): The number of points to keep.
+        method (str): Either "lttb" or "minmax".
+
+    Returns:
+        np.ndarray: Indices of the selected points in ascending order.
+
+    Raises:
+        ValueError: If the method is unknown.
+    """
+    if method == "lttb":
+        seconds = (created_at - created_at[0]) / np.timedelta64(1, "s") if len(created_at) else created_at
+        return lttb(seconds, values, points)
+    if method == "minmax":
+        return minmax(values, points)
+    raise ValueError(f"Unknown downsampling method {method}, expected one of {', '.join(METHODS)}")
+
+
+def downsample_chunks(created_at_chunks: list[np.ndarray], value_chunks: list[np.ndarray], points: int,
+                      method: str = "lttb", sort: bool = False) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Join a series read in chunks and reduce it for plotting.
+
+    This is CPU bound on long series; call it in a worker thread from async code.
+
+    Args:
+        created_at_chunks (list[np.ndarray]): Timestamps as datetime64 values, one array per chunk.
+        value_chunks (list[np.ndarray]): The measured values, parallel to created_at_chunks.
+        points (int): The number of points to keep.
+        method (str): Either "lttb" or "minmax".
+        sort (bool): Sort the joined series by time first, needed if the chunks are not in time order.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, int]: The timestamps and values of the selected points
+            and the length of the full series.
+    """
+    created_at = np.concatenate(created_at_chunks)
+    values = np.concatenate(value_chunks)
+    if sort:
+        order = np.argsort(created_at, kind="stable")
+        created_at, values = created_at[order], values[order]
+    selected = downsample(created_at, values, points, method)
+    return created_at[selected], values[selected], len(values)
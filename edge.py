@@ -0,0 +1,465 @@
+"""
+Edge store-and-forward mode.
+
+Field units run the API next to the sensors with EDGE_MODE enabled. Writes go to a
+local SQLite journal (WAL mode) so they succeed at local-disk latency even when the
+uplink to the central PostgreSQL database is down. A background forwarder syncs the
+journal to the central database in batches:
+
+* every journal row carries a client-generated id, inserts into the central database
+  use ON CONFLICT (client_id) DO NOTHING, so replaying a batch is harmless;
+* the last forwarded journal sequence number per stream is stored as a watermark in
+  the journal itself, so forwarding resumes where it stopped after a restart;
+* configs are forwarded before measurements so measurements that reference a config
+  created on the edge (by its client_id) can be resolved to the central id;
+* rows the central database rejects (e.g. a config_id that does not exist there) are
+  moved to a dead-letter table, so one bad row never blocks the rows after it;
+* forwarded measurements are deleted from the journal once they are older than the
+  retention period. Forwarded configs are kept, they are small and measurements are
+  validated against them.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import aiosqlite
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from settings import (
+    EDGE_JOURNAL_PATH,
+    EDGE_FORWARD_BATCH_SIZE,
+    EDGE_FORWARD_INTERVAL,
+    EDGE_JOURNAL_RETENTION_SECONDS,
+)
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS config_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT NOT NULL UNIQUE,
+    interval_value INTEGER,
+    frequency REAL,
+    rgb_camera INTEGER,
+    hsi_camera INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurement_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT NOT NULL UNIQUE,
+    snapshot_rgb_camera TEXT,
+    snapshot_hsi_camera TEXT,
+    acustic INTEGER,
+    config_id INTEGER,
+    config_client_id TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS forward_watermark (
+    stream TEXT PRIMARY KEY,
+    last_seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stream TEXT NOT NULL,
+    client_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    error TEXT NOT NULL,
+    failed_at TEXT NOT NULL,
+    UNIQUE (stream, client_id)
+);
+"""
+
+STREAMS = ("config", "measurement")
+
+forwarder_metrics = {
+    "forwarded": {stream: 0 for stream in STREAMS},
+    "last_batch_at": None,
+    "last_batch_rows": 0,
+    "last_batch_rows_per_second": 0.0,
+    "last_error": None,
+}
+
+_journal: aiosqlite.Connection | None = None
+
+
+class UnknownConfigError(ValueError):
+    """
+    Raised when a measurement references a config client_id that was never journaled.
+    """
+
+
+async def open_journal(path: str = EDGE_JOURNAL_PATH) -> aiosqlite.Connection:
+    """
+    Open the local SQLite journal and create its tables if needed.
+
+    Args:
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        aiosqlite.Connection: The journal connection, also available through get_journal().
+    """
+    global _journal
+    journal = await aiosqlite.connect(path)
+    journal.row_factory = aiosqlite.Row
+    await journal.execute("PRAGMA journal_mode=WAL")
+    await journal.execute("PRAGMA synchronous=NORMAL")
+    # Only takes effect for a new journal, lets prune_journal() give pages back to the OS
+    await journal.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    await journal.executescript(JOURNAL_SCHEMA)
+    await journal.commit()
+    _journal = journal
+    return journal
+
+
+async def close_journal():
+    """
+    Close the journal opened by open_journal().
+    """
+    global _journal
+    if _journal is not None:
+        await _journal.close()
+        _journal = None
+
+
+def get_journal() -> aiosqlite.Connection:
+    """
+    Return the journal opened by open_journal().
+
+    Raises:
+        RuntimeError: If the journal has not been opened.
+    """
+    if _journal is None:
+        raise RuntimeError("Edge journal is not open")
+    return _journal
+
+
+def _journal_row_to_dict(row: aiosqlite.Row) -> dict:
+    record = dict(row)
+    record["created_at"] = datetime.fromisoformat(record["created_at"])
+    return record
+
+
+async def _journal_insert(journal: aiosqlite.Connection, stream: str, record: dict) -> dict:
+    columns = ", ".join(record)
+    placeholders = ", ".join(f":{column}" for column in record)
+    await journal.execute(
+        f"INSERT INTO {stream}_journal ({columns}) VALUES ({placeholders}) ON CONFLICT (client_id) DO NOTHING",
+        {**record, "created_at": record["created_at"].isoformat()}
+    )
+    await journal.commit()
+    cursor = await journal.execute(f"SELECT * FROM {stream}_journal WHERE client_id = ?", (record["client_id"],))
+    stored = _journal_row_to_dict(await cursor.fetchone())
+    stored.pop("seq")
+    return {"id": None, **stored}
+
+
+async def journal_config(journal: aiosqlite.Connection, client_id: str, interval_value: int,
+                         frequency: float | None, rgb_camera: bool | None, hsi_camera: bool | None,
+                         created_at: datetime) -> dict:
+    """
+    Store a configuration in the local journal.
+
+    Returns:
+        dict: The journaled configuration. Its id is None until it is forwarded.
+    """
+    config = await _journal_insert(journal, "config", {
+        "client_id": client_id,
+        "interval_value": interval_value,
+        "frequency": frequency,
+        "rgb_camera": rgb_camera,
+        "hsi_camera": hsi_camera,
+        "created_at": created_at,
+    })
+    for column in ("rgb_camera", "hsi_camera"):
+        if config[column] is not None:
+            config[column] = bool(config[column])
+    return config
+
+
+async def journal_measurement(journal: aiosqlite.Connection, client_id: str, snapshot_rgb_camera: str | None,
+                              snapshot_hsi_camera: str | None, acustic: int | None, config_id: int | None,
+                              config_client_id: str | None, created_at: datetime) -> dict:
+    """
+    Store a measurement in the local journal.
+
+    Returns:
+        dict: The journaled measurement. Its id is None until it is forwarded.
+
+    Raises:
+        UnknownConfigError: If config_client_id does not match a journaled configuration.
+    """
+    if config_client_id is not None:
+        cursor = await journal.execute("SELECT 1 FROM config_journal WHERE client_id = ?", (config_client_id,))
+        if await cursor.fetchone() is None:
+            raise UnknownConfigError(f"Config with client id {config_client_id} not found")
+    return await _journal_insert(journal, "measurement", {
+        "client_id": client_id,
+        "snapshot_rgb_camera": snapshot_rgb_camera,
+        "snapshot_hsi_camera": snapshot_hsi_camera,
+        "acustic": acustic,
+        "config_id": config_id,
+        "config_client_id": config_client_id,
+        "created_at": created_at,
+    })
+
+
+async def _watermark(journal: aiosqlite.Connection, stream: str) -> int:
+    cursor = await journal.execute("SELECT last_seq FROM forward_watermark WHERE stream = ?", (stream,))
+    row = await cursor.fetchone()
+    return row["last_seq"] if row else 0
+
+
+async def _pending_rows(journal: aiosqlite.Connection, stream: str, batch_size: int) -> list[dict]:
+    cursor = await journal.execute(
+        f"SELECT * FROM {stream}_journal WHERE seq > ? ORDER BY seq LIMIT ?",
+        (await _watermark(journal, stream), batch_size)
+    )
+    return [_journal_row_to_dict(row) for row in await cursor.fetchall()]
+
+
+async def _advance_watermark(journal: aiosqlite.Connection, stream: str, last_seq: int,
+                             dead_letters: list[tuple[dict, str]] = ()):
+    """
+    Move the watermark of a stream and store its dead letters in one journal transaction.
+    """
+    failed_at = datetime.now().isoformat()
+    await journal.executemany("""
+        INSERT INTO dead_letter (stream, client_id, payload, error, failed_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (stream, client_id) DO NOTHING
+    """, [
+        (stream, row["client_id"], json.dumps(row, default=str), error, failed_at)
+        for row, error in dead_letters
+    ])
+    await journal.execute("""
+        INSERT INTO forward_watermark (stream, last_seq) VALUES (?, ?)
+        ON CONFLICT (stream) DO UPDATE SET last_seq = excluded.last_seq
+    """, (stream, last_seq))
+    await journal.commit()
+
+
+async def prune_journal(journal: aiosqlite.Connection,
+                        retention_seconds: float = EDGE_JOURNAL_RETENTION_SECONDS) -> int:
+    """
+    Delete forwarded measurements older than the retention period from the journal.
+
+    Only rows at or below the measurement watermark are deleted, so nothing that
+    still has to be forwarded is lost.
+
+    Args:
+        journal (aiosqlite.Connection): The local journal.
+        retention_seconds (float): How long forwarded measurements are kept.
+
+    Returns:
+        int: The number of deleted rows.
+    """
+    cursor = await journal.execute(
+        "DELETE FROM measurement_journal WHERE seq <= ? AND created_at < ?",
+        (await _watermark(journal, "measurement"),
+         (datetime.now() - timedelta(seconds=retention_seconds)).isoformat())
+    )
+    await journal.commit()
+    if cursor.rowcount:
+        await journal.execute("PRAGMA incremental_vacuum")
+    return cursor.rowcount
+
+
+async def _insert_rows(session: AsyncSession, statement, rows: list[dict], params: list[dict]) -> list[tuple[dict, str]]:
+    """
+    Insert a batch into the central database and commit it.
+
+    If the central database rejects the batch, the rows are retried one by one, each
+    in its own savepoint, so only the rejected rows are left out. Connection errors are
+    not caught: the batch is then retried as a whole on the next pass.
+
+    Returns:
+        list[tuple[dict, str]]: The rejected rows with their error messages.
+    """
+    if not rows:
+        return []
+    try:
+        await session.execute(statement, params)
+        await session.commit()
+        return []
+    except (IntegrityError, DataError):
+        await session.rollback()
+
+    rejected = []
+    for row, row_params in zip(rows, params):
+        try:
+            async with session.begin_nested():
+                await session.execute(statement, row_params)
+        except (IntegrityError, DataError) as e:
+            rejected.append((row, str(e.orig)))
+    await session.commit()
+    return rejected
+
+
+async def forward_configs(journal: aiosqlite.Connection, session: AsyncSession,
+                          batch_size: int = EDGE_FORWARD_BATCH_SIZE) -> int:
+    """
+    Forward the next batch of journaled configurations to the central database.
+
+    Returns:
+        int: The number of forwarded configurations.
+    """
+    rows = await _pending_rows(journal, "config", batch_size)
+    if not rows:
+        return 0
+    rejected = await _insert_rows(session, text("""
+        INSERT INTO config (client_id, interval_value, frequency, rgb_camera, hsi_camera, created_at)
+        VALUES (:client_id, :interval_value, :frequency, :rgb_camera, :hsi_camera, :created_at)
+        ON CONFLICT (client_id) DO NOTHING
+    """), rows, [
+        {
+            "client_id": row["client_id"],
+            "interval_value": row["interval_value"],
+            "frequency": row["frequency"],
+            "rgb_camera": None if row["rgb_camera"] is None else bool(row["rgb_camera"]),
+            "hsi_camera": None if row["hsi_camera"] is None else bool(row["hsi_camera"]),
+            "created_at": row["created_at"],
+        } for row in rows
+    ])
+    await _advance_watermark(journal, "config", rows[-1]["seq"], rejected)
+    return len(rows) - len(rejected)
+
+
+async def forward_measurements(journal: aiosqlite.Connection, session: AsyncSession,
+                               batch_size: int = EDGE_FORWARD_BATCH_SIZE,
+                               retention_seconds: float = EDGE_JOURNAL_RETENTION_SECONDS) -> int:
+    """
+    Forward the next batch of journaled measurements to the central database.
+
+    Measurements referencing a config by its client_id are resolved to the central
+    config id. The batch stops before the first measurement whose config is still
+    waiting in the journal, so journal order is preserved. A measurement whose config
+    was forwarded but is not in the central database (because it was rejected) is
+    moved to the dead letters. Forwarded measurements are then pruned from the journal,
+    see prune_journal().
+
+    Returns:
+        int: The number of forwarded measurements.
+    """
+    rows = await _pending_rows(journal, "measurement", batch_size)
+    config_client_ids = list({row["config_client_id"] for row in rows if row["config_client_id"]})
+    config_ids = {}
+    if config_client_ids:
+        result = await session.execute(
+            text("SELECT id, client_id FROM config WHERE client_id = ANY(:client_ids)"),
+            {"client_ids": config_client_ids}
+        )
+        config_ids = {client_id: config_id for config_id, client_id in result.fetchall()}
+
+    config_watermark = await _watermark(journal, "config")
+    ready = []
+    unresolved = []
+    for row in rows:
+        if row["config_client_id"] and row["config_client_id"] not in config_ids:
+            cursor = await journal.execute(
+                "SELECT 1 FROM config_journal WHERE client_id = ? AND seq > ?",
+                (row["config_client_id"], config_watermark)
+            )
+            if await cursor.fetchone() is not None:
+                break
+            unresolved.append((row, f"Config with client id {row['config_client_id']} was not forwarded"))
+            continue
+        ready.append(row)
+    processed = len(ready) + len(unresolved)
+    if not processed:
+        return 0
+
+    rejected = await _insert_rows(session, text("""
+        INSERT INTO measurement (client_id, snapshot_rgb_camera, snapshot_hsi_camera, acustic, config_id, created_at)
+        VALUES (:client_id, :snapshot_rgb_camera, :snapshot_hsi_camera, :acustic, :config_id, :created_at)
+        ON CONFLICT (client_id) DO NOTHING
+    """), ready, [
+        {
+            "client_id": row["client_id"],
+            "snapshot_rgb_camera": row["snapshot_rgb_camera"],
+            "snapshot_hsi_camera": row["snapshot_hsi_camera"],
+            "acustic": row["acustic"],
+            "config_id": config_ids.get(row["config_client_id"], row["config_id"]),
+            "created_at": row["created_at"],
+        } for row in ready
+    ])
+    await _advance_watermark(journal, "measurement", rows[processed - 1]["seq"], unresolved + rejected)
+    await prune_journal(journal, retention_seconds)
+    return len(ready) - len(rejected)
+
+
+async def forward_once(journal: aiosqlite.Connection, session: AsyncSession,
+                       batch_size: int = EDGE_FORWARD_BATCH_SIZE) -> int:
+    """
+    Forward one batch of configurations and one batch of measurements and update the metrics.
+
+    Returns:
+        int: The total number of forwarded rows.
+    """
+    started = time.perf_counter()
+    forwarded = {
+        "config": await forward_configs(journal, session, batch_size),
+        "measurement": await forward_measurements(journal, session, batch_size),
+    }
+    total = sum(forwarded.values())
+    if total:
+        elapsed = time.perf_counter() - started
+        for stream, count in forwarded.items():
+            forwarder_metrics["forwarded"][stream] += count
+        forwarder_metrics["last_batch_at"] = datetime.now()
+        forwarder_metrics["last_batch_rows"] = total
+        forwarder_metrics["last_batch_rows_per_second"] = total / elapsed if elapsed else 0.0
+    forwarder_metrics["last_error"] = None
+    return total
+
+
+async def run_forwarder(session_factory, journal: aiosqlite.Connection,
+                        interval: float = EDGE_FORWARD_INTERVAL, batch_size: int = EDGE_FORWARD_BATCH_SIZE):
+    """
+    Forward the journal to the central database until cancelled.
+
+    The backlog is drained without pausing; the forwarder sleeps for the given
+    interval only when there is nothing to forward or the central database is unreachable.
+
+    Args:
+        session_factory (sessionmaker): Factory for central database sessions.
+        journal (aiosqlite.Connection): The local journal.
+        interval (float): Seconds to wait between idle polls.
+        batch_size (int): Maximum number of rows forwarded per stream and batch.
+    """
+    while True:
+        try:
+            async with session_factory() as session:
+                forwarded = await forward_once(journal, session, batch_size)
+        except Exception as e:
+            forwarder_metrics["last_error"] = str(e)
+            forwarded = 0
+        if not forwarded:
+            await asyncio.sleep(interval)
+
+
+async def forwarder_status(journal: aiosqlite.Connection) -> dict:
+    """
+    Report forwarding throughput and lag.
+
+    Returns:
+        dict: The forwarder metrics plus, for each stream, the number of rows waiting
+              to be forwarded, the age in seconds of the oldest one and the number of
+              rows moved to the dead letters.
+    """
+    pending = {}
+    for stream in STREAMS:
+        cursor = await journal.execute(
+            f"SELECT COUNT(*) AS count, MIN(created_at) AS oldest FROM {stream}_journal WHERE seq > ?",
+            (await _watermark(journal, stream),)
+        )
+        row = await cursor.fetchone()
+        lag = (datetime.now() - datetime.fromisoformat(row["oldest"])).total_seconds() if row["oldest"] else 0.0
+        pending[stream] = {"count": row["count"], "lag_seconds": lag}
+    cursor = await journal.execute("SELECT stream, COUNT(*) AS count FROM dead_letter GROUP BY stream")
+    dead_letters = {stream: 0 for stream in STREAMS} | {row["stream"]: row["count"] for row in await cursor.fetchall()}
+    return {
+        **forwarder_metrics,
+        "forwarded": dict(forwarder_metrics["forwarded"]),
+        "pending": pending,
+        "dead_letters": dead_letters,
+    }
@@ -1,23 +1,79 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
-from fastapi import FastAPI, status, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from typing import Annotated, Literal
+from uuid import uuid4
+from fastapi import FastAPI, status, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 from pydantic import BaseModel
+import numpy as np
 from collections.abc import AsyncGenerator
 from fastapi.middleware.cors import CORSMiddleware
 
-from settings import DATABASE_URL
+from settings import (
+    DATABASE_URL,
+    EDGE_MODE,
+    MAX_BATCH_IDS,
+    SERIES_DEFAULT_POINTS,
+    SERIES_MAX_POINTS,
+    SERIES_CHUNK_SIZE,
+    PROFILING_MAX_SECONDS,
+)
+from archive import (
+    read_archived_measurement_by_id,
+    read_archived_measurements_by_ids,
+    read_archived_measurements_by_config_id,
+    read_archived_series,
+    load_archived_snapshots,
+)
+from cancellation import (
+    CancelOnDisconnectMiddleware,
+    close_session,
+    statement_timeout_for,
+    with_statement_timeout,
+)
+from arrow_format import MEASUREMENT_SCHEMA, arrow_response, select_columns, wants_arrow
+from downsampling import downsample_chunks
+from profiling import ProfilingMiddleware, profile_process, profiling_authorized
+from edge import (
+    open_journal,
+    close_journal,
+    get_journal,
+    journal_config,
+    journal_measurement,
+    run_forwarder,
+    forwarder_status,
+    UnknownConfigError,
+)
+
+_engine: AsyncEngine | None = None
 
 def get_engine():
     """
-    Create and return an async SQLAlchemy engine instance.
+    Return the shared async SQLAlchemy engine, creating it on first use.
+    
+    All sessions share the engine and its connection pool. It is created when the
+    application starts and disposed when it stops, see dispose_engine().
     
     Returns:
         AsyncEngine: A SQLAlchemy async engine instance configured with the database URL.
     """
-    return create_async_engine(DATABASE_URL, echo=True, future=True)
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+    return _engine
+
+async def dispose_engine():
+    """
+    Close all pooled connections of the shared engine.
+    """
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
 
 def get_session():
     """
@@ -29,24 +85,70 @@ def get_session():
     engine = get_engine()
     return sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
-async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
+def open_session(endpoint: str | None) -> AsyncSession:
+    """
+    Open a database session with the statement timeout configured for an endpoint.
+    
+    Args:
+        endpoint (str, optional): The name of the endpoint function.
+        
+    Returns:
+        AsyncSession: A new async database session. The caller is responsible for closing it.
+    """
+    SessionLocal = get_session()
+    return with_statement_timeout(SessionLocal(), statement_timeout_for(endpoint))
+
+async def get_db_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
     """
     Dependency that creates and yields a database session.
     
+    The session gets the statement timeout configured for the endpoint handling the request.
+    
+    Args:
+        request (Request): The current request.
+        
     Yields:
-        AsyncSession: An async database session that will be automatically closed after use.
+        AsyncSession: An async database session that will be automatically closed after use,
+                      also when the request is cancelled because the client disconnected.
         
     Note:
         This is designed to be used as a FastAPI dependency for route handlers.
     """
-    SessionLocal = get_session()
-    async with SessionLocal() as session:
+    endpoint = request.scope.get("endpoint")
+    session = open_session(getattr(endpoint, "__name__", None))
+    try:
         yield session
+    finally:
+        await close_session(session)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the shared database engine, and open the edge journal and start the
+    forwarder when running in edge mode.
+    
+    Args:
+        app (FastAPI): The application instance.
+    """
+    get_engine()
+    if not EDGE_MODE:
+        yield
+        await dispose_engine()
+        return
+    journal = await open_journal()
+    forwarder = asyncio.create_task(run_forwarder(get_session(), journal))
+    yield
+    forwarder.cancel()
+    with suppress(asyncio.CancelledError):
+        await forwarder
+    await close_journal()
+    await dispose_engine()
 
 app = FastAPI(
     title="Measurement API",
     description="API for managing measurements and configurations",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -57,6 +159,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
 
 class ConfigCreateRequest(BaseModel):
     """
@@ -67,11 +172,98 @@ class ConfigCreateRequest(BaseModel):
         frequency (float, optional): The frequency setting. Defaults to None.
         rgb_camera (bool, optional): Whether RGB camera is enabled. Defaults to None.
         hsi_camera (bool, optional): Whether HSI camera is enabled. Defaults to None.
+        client_id (str, optional): Client-generated unique ID used to deduplicate retries. Defaults to None.
     """
     interval_value: int
     frequency: float | None = None
     rgb_camera: bool | None = None
     hsi_camera: bool | None = None
+    client_id: str | None = None
+
+class IdsRequest(BaseModel):
+    """
+    Pydantic model for looking up several entries by their IDs.
+    
+    Attributes:
+        ids (list[int]): The IDs to look up, in the order the results should be returned.
+            At most MAX_BATCH_IDS, duplicates included.
+    """
+    ids: list[int]
+
+def parse_ids(values: list[str]) -> list[int]:
+    """
+    Parse IDs given as repeated and/or comma-separated query parameters.
+    
+    Args:
+        values (list[str]): The raw query parameter values, e.g. ["1,2", "3"].
+        
+    Returns:
+        list[int]: The parsed IDs in the given order.
+        
+    Raises:
+        ValueError: If a value is not an integer.
+    """
+    return [int(value) for item in values for value in item.split(",") if value.strip()]
+
+async def fetch_by_ids(session: AsyncSession, table: str, ids: list[int]) -> tuple[dict[int, dict], list[int]]:
+    """
+    Fetch rows of a table by their IDs with a single query.
+    
+    Args:
+        session (AsyncSession): The database session.
+        table (str): The table to read from.
+        ids (list[int]): The IDs to fetch, already de-duplicated.
+        
+    Returns:
+        tuple: The found rows keyed by ID, and the IDs that were not found.
+    """
+    result = await session.execute(text(f"SELECT * FROM {table} WHERE id = ANY(:ids)"), {"ids": ids})
+    rows = {}
+    for row in result.fetchall():
+        record = dict(row._mapping)
+        rows[record["id"]] = record
+    return rows, [row_id for row_id in ids if row_id not in rows]
+
+async def attach_configs(session: AsyncSession, measurements: list[dict]) -> list[dict]:
+    """
+    Nest the configuration of each measurement under its "config" key.
+    
+    All configurations are fetched with one de-duplicated query, however many
+    measurements share them.
+    
+    Args:
+        session (AsyncSession): The database session.
+        measurements (list[dict]): The measurements to expand.
+        
+    Returns:
+        list[dict]: The same measurements, each with a "config" entry (None if it has no configuration).
+    """
+    config_ids = list(dict.fromkeys(
+        measurement["config_id"] for measurement in measurements if measurement.get("config_id") is not None
+    ))
+    configs = (await fetch_by_ids(session, "config", config_ids))[0] if config_ids else {}
+    for measurement in measurements:
+        measurement["config"] = configs.get(measurement.get("config_id"))
+    return measurements
+
+def batch_ids_error(ids: list[int]) -> JSONResponse | None:
+    """
+    Validate the size of a batch lookup.
+    
+    Returns:
+        JSONResponse | None: A 422 response if the batch is empty or too large, otherwise None.
+    """
+    if not ids:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"status": "error", "message": "At least one id is required"}
+        )
+    if len(ids) > MAX_BATCH_IDS:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"status": "error", "message": f"At most {MAX_BATCH_IDS} ids can be requested at once"}
+        )
+    return None
 
 @app.get("/check-db", status_code=status.HTTP_200_OK)
 async def select_demo(session: AsyncSession = Depends(get_db_session)):
@@ -133,12 +325,20 @@ async def db_schema(session: AsyncSession = Depends(get_db_session)):
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
 
 @app.get("/measurements", status_code=status.HTTP_200_OK)
-async def read_measurements(session: AsyncSession = Depends(get_db_session)):
+async def read_measurements(
+    session: AsyncSession = Depends(get_db_session),
+    accept: Annotated[str | None, Header()] = None,
+    expand: Annotated[Literal["config"] | None, Query()] = None
+):
     """
     Retrieve all measurements from the database.
     
     Args:
         session (AsyncSession): The database session dependency.
+        accept (str, optional): The Accept header. With `application/vnd.apache.arrow.stream`
+            the measurements are streamed as Arrow record batches instead of JSON.
+        expand (str, optional): With "config", the configuration of each measurement is
+            nested under its "config" key. Only applies to JSON responses.
         
     Returns:
         dict: A dictionary containing a list of all measurements.
@@ -147,12 +347,90 @@ async def read_measurements(session: AsyncSession = Depends(get_db_session)):
         HTTPException: If there's an error retrieving the measurements.
     """
     try:
+        if wants_arrow(accept):
+            return await arrow_response(
+                open_session("read_measurements"),
+                text(f"SELECT {select_columns(MEASUREMENT_SCHEMA)} FROM measurement"),
+                {},
+                MEASUREMENT_SCHEMA
+            )
         result = await session.execute(text("SELECT * FROM measurement"))
         measurements = [dict(row._mapping) for row in result.fetchall()]
+        if expand == "config":
+            await attach_configs(session, measurements)
         return {"measurements": measurements}
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
 
+async def measurements_by_ids(ids: list[int], session: AsyncSession):
+    """
+    Look up measurements by IDs, falling back to the Parquet archive for IDs not in the database.
+    
+    Returns:
+        dict | JSONResponse: The measurements in requested order and the IDs that were not found.
+    """
+    # Checked before duplicates are dropped, so the cap bounds the work done per request
+    error = batch_ids_error(ids)
+    if error:
+        return error
+    ids = list(dict.fromkeys(ids))
+    try:
+        measurements, missing = await fetch_by_ids(session, "measurement", ids)
+        if missing:
+            for archived in await asyncio.to_thread(read_archived_measurements_by_ids, missing):
+                measurements[archived["id"]] = archived
+        return {
+            "measurements": [measurements[measurement_id] for measurement_id in ids if measurement_id in measurements],
+            "missing": [measurement_id for measurement_id in ids if measurement_id not in measurements]
+        }
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.get("/measurements/by-ids", status_code=status.HTTP_200_OK)
+async def read_measurements_by_ids(
+    ids: Annotated[list[str], Query()],
+    session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Retrieve several measurements by their IDs with a single query.
+    
+    Args:
+        ids (list[str]): The measurement IDs, as repeated and/or comma-separated query parameters.
+        session (AsyncSession): The database session dependency.
+        
+    Returns:
+        dict: A dictionary containing the found measurements in requested order
+              and a list of the IDs that were not found.
+              
+    Raises:
+        HTTPException: 422 if an ID is not an integer or too many IDs are requested.
+        HTTPException: 500 if there's an error retrieving the measurements.
+    """
+    try:
+        parsed_ids = parse_ids(ids)
+    except ValueError as e:
+        return JSONResponse(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"status": "error", "message": str(e)})
+    return await measurements_by_ids(parsed_ids, session)
+
+@app.post("/measurements/by-ids", status_code=status.HTTP_200_OK)
+async def read_measurements_by_ids_body(payload: IdsRequest, session: AsyncSession = Depends(get_db_session)):
+    """
+    Retrieve several measurements by IDs given in the request body, for lists too long for a URL.
+    
+    Args:
+        payload (IdsRequest): The measurement IDs.
+        session (AsyncSession): The database session dependency.
+        
+    Returns:
+        dict: A dictionary containing the found measurements in requested order
+              and a list of the IDs that were not found.
+              
+    Raises:
+        HTTPException: 422 if too many IDs are requested.
+        HTTPException: 500 if there's an error retrieving the measurements.
+    """
+    return await measurements_by_ids(payload.ids, session)
+
 @app.get("/config", status_code=status.HTTP_200_OK)
 async def read_config(session: AsyncSession = Depends(get_db_session)):
     """
@@ -179,6 +457,8 @@ async def create_config(payload: ConfigCreateRequest, session: AsyncSession = De
     """
     Create a new configuration entry in the database.
     
+    In edge mode the configuration is written to the local journal and forwarded later.
+    
     Args:
         payload (ConfigCreateRequest): The configuration data to be created.
         session (AsyncSession): The database session dependency.
@@ -190,11 +470,23 @@ async def create_config(payload: ConfigCreateRequest, session: AsyncSession = De
         HTTPException: If there's an error creating the configuration.
     """
     try:
+        if EDGE_MODE:
+            config = await journal_config(
+                get_journal(),
+                client_id=payload.client_id or str(uuid4()),
+                interval_value=payload.interval_value,
+                frequency=payload.frequency,
+                rgb_camera=payload.rgb_camera,
+                hsi_camera=payload.hsi_camera,
+                created_at=datetime.now()
+            )
+            return {"config": [config]}
         result = await session.execute(text("""
-            INSERT INTO config (interval_value, frequency, rgb_camera, hsi_camera, created_at)
-            VALUES (:interval_value, :frequency, :rgb_camera, :hsi_camera, :created_at)
+            INSERT INTO config (client_id, interval_value, frequency, rgb_camera, hsi_camera, created_at)
+            VALUES (:client_id, :interval_value, :frequency, :rgb_camera, :hsi_camera, :created_at)
             RETURNING *
         """), {
+            "client_id": payload.client_id,
             "interval_value": payload.interval_value,
             "frequency": payload.frequency,
             "rgb_camera": payload.rgb_camera,
@@ -215,23 +507,31 @@ async def create_measurement(
     acustic: int | None = None, 
     config_id: int | None = None, 
     created_at: datetime | None = datetime.now(), 
+    client_id: str | None = None,
+    config_client_id: str | None = None,
     session: AsyncSession = Depends(get_db_session)
 ):
     """
     Create a new measurement entry in the database.
     
+    In edge mode the measurement is written to the local journal and forwarded later.
+    
     Args:
         snapshot_rgb_camera (str, optional): Base64 encoded RGB camera snapshot. Defaults to None.
         snapshot_hsi_camera (str, optional): Base64 encoded HSI camera snapshot. Defaults to None.
         acustic (int, optional): Acoustic measurement value. Defaults to None.
         config_id (int, optional): ID of the associated configuration. Defaults to None.
         created_at (datetime, optional): Timestamp of the measurement. Defaults to current time.
+        client_id (str, optional): Client-generated unique ID used to deduplicate retries. Defaults to None.
+        config_client_id (str, optional): Client ID of a configuration created in edge mode
+            that has not been forwarded yet. Only used in edge mode. Defaults to None.
         session (AsyncSession): The database session dependency.
         
     Returns:
         dict: A dictionary containing the created measurement.
         
     Raises:
+        HTTPException: 422 if config_client_id does not match a configuration created in edge mode.
         HTTPException: If there's an error creating the measurement.
     """
     try:
@@ -242,13 +542,89 @@ async def create_measurement(
         if snapshot_rgb_camera == "None":
             snapshot_rgb_camera_preprocessed = None
         date = datetime.now()
-        result = await session.execute(text("INSERT INTO measurement (snapshot_rgb_camera, snapshot_hsi_camera, acustic, config_id, created_at) VALUES (:snapshot_rgb_camera, :snapshot_hsi_camera, :acustic, :config_id, :created_at) RETURNING *"), {"snapshot_rgb_camera": snapshot_rgb_camera_preprocessed, "snapshot_hsi_camera": snapshot_hsi_camera_preprocessed, "acustic": acustic, "config_id": config_id, "created_at": date})
+        if EDGE_MODE:
+            measurement = await journal_measurement(
+                get_journal(),
+                client_id=client_id or str(uuid4()),
+                snapshot_rgb_camera=snapshot_rgb_camera_preprocessed,
+                snapshot_hsi_camera=snapshot_hsi_camera_preprocessed,
+                acustic=acustic,
+                config_id=config_id,
+                config_client_id=config_client_id,
+                created_at=date
+            )
+            return {"measurement": [measurement]}
+        result = await session.execute(text("INSERT INTO measurement (client_id, snapshot_rgb_camera, snapshot_hsi_camera, acustic, config_id, created_at) VALUES (:client_id, :snapshot_rgb_camera, :snapshot_hsi_camera, :acustic, :config_id, :created_at) RETURNING *"), {"client_id": client_id, "snapshot_rgb_camera": snapshot_rgb_camera_preprocessed, "snapshot_hsi_camera": snapshot_hsi_camera_preprocessed, "acustic": acustic, "config_id": config_id, "created_at": date})
         await session.commit()
         measurement = [dict(row._mapping) for row in result.fetchall()]
         return {"measurement": measurement}
+    except UnknownConfigError as e:
+        return JSONResponse(status_code=422, content={"status": "error", "message": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
 
+async def configs_by_ids(ids: list[int], session: AsyncSession):
+    """
+    Look up configurations by IDs.
+    
+    Returns:
+        dict | JSONResponse: The configurations in requested order and the IDs that were not found.
+    """
+    error = batch_ids_error(ids)
+    if error:
+        return error
+    ids = list(dict.fromkeys(ids))
+    try:
+        config, missing = await fetch_by_ids(session, "config", ids)
+        return {"config": [config[config_id] for config_id in ids if config_id in config], "missing": missing}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.get("/config/by-ids", status_code=status.HTTP_200_OK)
+async def read_config_by_ids(
+    ids: Annotated[list[str], Query()],
+    session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Retrieve several configurations by their IDs with a single query.
+    
+    Args:
+        ids (list[str]): The configuration IDs, as repeated and/or comma-separated query parameters.
+        session (AsyncSession): The database session dependency.
+        
+    Returns:
+        dict: A dictionary containing the found configurations in requested order
+              and a list of the IDs that were not found.
+              
+    Raises:
+        HTTPException: 422 if an ID is not an integer or too many IDs are requested.
+        HTTPException: 500 if there's an error retrieving the configurations.
+    """
+    try:
+        parsed_ids = parse_ids(ids)
+    except ValueError as e:
+        return JSONResponse(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"status": "error", "message": str(e)})
+    return await configs_by_ids(parsed_ids, session)
+
+@app.post("/config/by-ids", status_code=status.HTTP_200_OK)
+async def read_config_by_ids_body(payload: IdsRequest, session: AsyncSession = Depends(get_db_session)):
+    """
+    Retrieve several configurations by IDs given in the request body, for lists too long for a URL.
+    
+    Args:
+        payload (IdsRequest): The configuration IDs.
+        session (AsyncSession): The database session dependency.
+        
+    Returns:
+        dict: A dictionary containing the found configurations in requested order
+              and a list of the IDs that were not found.
+              
+    Raises:
+        HTTPException: 422 if too many IDs are requested.
+        HTTPException: 500 if there's an error retrieving the configurations.
+    """
+    return await configs_by_ids(payload.ids, session)
+
 @app.get("/config/{config_id}", status_code=status.HTTP_200_OK)
 async def read_config_by_id(config_id: int, session: AsyncSession = Depends(get_db_session)):
     """
@@ -278,13 +654,21 @@ async def read_config_by_id(config_id: int, session: AsyncSession = Depends(get_
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
 
 @app.get("/measurement/{measurement_id}", status_code=status.HTTP_200_OK)
-async def read_measurement_by_id(measurement_id: int, session: AsyncSession = Depends(get_db_session)):
+async def read_measurement_by_id(
+    measurement_id: int,
+    session: AsyncSession = Depends(get_db_session),
+    expand: Annotated[Literal["config"] | None, Query()] = None
+):
     """
     Retrieve a specific measurement by its ID.
     
+    Measurements that are no longer in the database are looked up in the Parquet archive.
+    
     Args:
         measurement_id (int): The ID of the measurement to retrieve.
         session (AsyncSession): The database session dependency.
+        expand (str, optional): With "config", the configuration of each measurement is
+            nested under its "config" key. Only applies to JSON responses.
         
     Returns:
         dict: A dictionary containing the requested measurement.
@@ -294,26 +678,53 @@ async def read_measurement_by_id(measurement_id: int, session: AsyncSession = De
         HTTPException: 500 if there's an error retrieving the measurement.
     """
     try:
-        result = await session.execute(text("SELECT * FROM measurement WHERE id = :measurement_id"), {"measurement_id": measurement_id})
+        if expand == "config":
+            result = await session.execute(text("""
+                SELECT measurement.*,
+                       CASE WHEN config.id IS NULL THEN NULL ELSE row_to_json(config) END AS config
+                FROM measurement
+                LEFT JOIN config ON config.id = measurement.config_id
+                WHERE measurement.id = :measurement_id
+            """), {"measurement_id": measurement_id})
+        else:
+            result = await session.execute(text("SELECT * FROM measurement WHERE id = :measurement_id"), {"measurement_id": measurement_id})
         measurement = result.fetchone()
-        if not measurement:
+        if measurement:
+            return {"measurement": dict(measurement._mapping)}
+        archived = await asyncio.to_thread(read_archived_measurement_by_id, measurement_id)
+        if not archived:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content={"status": "error", "message": f"Measurement with id {measurement_id} not found"}
             )
-        return {"measurement": dict(measurement._mapping)}
+        if expand == "config":
+            await attach_configs(session, [archived])
+        return {"measurement": archived}
     except Exception as e:
         print(e)
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
 
 @app.get("/measurement/config/{config_id}", status_code=status.HTTP_200_OK)
-async def read_measurement_by_config_id(config_id: int, session: AsyncSession = Depends(get_db_session)):
+async def read_measurement_by_config_id(
+    config_id: int,
+    session: AsyncSession = Depends(get_db_session),
+    accept: Annotated[str | None, Header()] = None,
+    expand: Annotated[Literal["config"] | None, Query()] = None
+):
     """
     Retrieve all measurements associated with a specific configuration ID.
     
+    Archived measurements from the Parquet tier are returned before the ones still in the database.
+    A measurement found in both is returned once from the database, and archived snapshots
+    are loaded only for the rows sent.
+    
     Args:
         config_id (int): The ID of the configuration to get measurements for.
         session (AsyncSession): The database session dependency.
+        accept (str, optional): The Accept header. With `application/vnd.apache.arrow.stream`
+            the measurements are streamed as Arrow record batches instead of JSON.
+        expand (str, optional): With "config", the configuration of each measurement is
+            nested under its "config" key. Only applies to JSON responses.
         
     Returns:
         dict: A dictionary containing a list of measurements for the specified configuration.
@@ -323,14 +734,157 @@ async def read_measurement_by_config_id(config_id: int, session: AsyncSession =
         HTTPException: 500 if there's an error retrieving the measurements.
     """
     try:
+        not_found = JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"status": "error", "message": f"Measurement with config id {config_id} not found"}
+        )
+        archived = await asyncio.to_thread(read_archived_measurements_by_config_id, config_id, with_snapshots=False)
+        if wants_arrow(accept):
+            if archived:
+                # Measurements archived by a batch that failed before its DELETE are still in the database
+                result = await session.execute(
+                    text("SELECT id FROM measurement WHERE config_id = :config_id AND created_at <= :newest"),
+                    {"config_id": config_id, "newest": max(row["created_at"] for row in archived)}
+                )
+                live_ids = set(result.scalars().all())
+                archived = [row for row in archived if row["id"] not in live_ids]
+            return await arrow_response(
+                open_session("read_measurement_by_config_id"),
+                text(f"SELECT {select_columns(MEASUREMENT_SCHEMA)} FROM measurement WHERE config_id = :config_id"),
+                {"config_id": config_id},
+                MEASUREMENT_SCHEMA,
+                leading_rows=archived,
+                prepare_leading_rows=load_archived_snapshots,
+                not_found=not_found
+            )
         result = await session.execute(text("SELECT * FROM measurement WHERE config_id = :config_id"), {"config_id": config_id})
-        measurement = result.fetchall()
+        live = [dict(row._mapping) for row in result.fetchall()]
+        live_ids = {row["id"] for row in live}
+        archived = [row for row in archived if row["id"] not in live_ids]
+        measurement = await asyncio.to_thread(load_archived_snapshots, archived) + live
         if not measurement:
-            return JSONResponse(
-                status_code=status.HTTP_404_NOT_FOUND,
-                content={"status": "error", "message": f"Measurement with config id {config_id} not found"}
-            )
-        return {"measurement": [dict(row._mapping) for row in measurement]}
+            return not_found
+        if expand == "config":
+            await attach_configs(session, measurement)
+        return {"measurement": measurement}
     except Exception as e:
         print(e)
-        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.get("/measurement/config/{config_id}/series", status_code=status.HTTP_200_OK)
+async def read_measurement_series(
+    config_id: int,
+    points: Annotated[int, Query(ge=3, le=SERIES_MAX_POINTS)] = SERIES_DEFAULT_POINTS,
+    from_: Annotated[datetime | None, Query(alias="from")] = None,
+    to: Annotated[datetime | None, Query()] = None,
+    method: Annotated[Literal["lttb", "minmax"], Query()] = "lttb",
+    session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Retrieve the acoustic series of a configuration reduced to a plot-ready number of points.
+    
+    The (created_at, acustic) pairs are streamed from the database in chunks into NumPy
+    arrays and downsampled with LTTB or min-max per bucket. Archived measurements are included.
+    
+    Args:
+        config_id (int): The ID of the configuration.
+        points (int, optional): The number of points to return. Defaults to SERIES_DEFAULT_POINTS.
+        from_ (datetime, optional): Only include measurements created at or after this time.
+        to (datetime, optional): Only include measurements created before this time.
+        method (str, optional): The downsampling algorithm, "lttb" or "minmax". Defaults to "lttb".
+        session (AsyncSession): The database session dependency.
+        
+    Returns:
+        dict: A dictionary with the total number of measurements in the range and the
+              selected points as parallel created_at and acustic arrays.
+              
+    Raises:
+        HTTPException: 422 if the parameters are invalid.
+        HTTPException: 500 if there's an error retrieving the measurements.
+    """
+    try:
+        archived = await asyncio.to_thread(read_archived_series, config_id, from_, to)
+        created_at = [archived.column("created_at").to_numpy()]
+        acustic = [archived.column("acustic").to_numpy()]
+
+        conditions = ["config_id = :config_id", "acustic IS NOT NULL"]
+        params = {"config_id": config_id}
+        if from_ is not None:
+            conditions.append("created_at >= :from")
+            params["from"] = from_
+        if to is not None:
+            conditions.append("created_at < :to")
+            params["to"] = to
+        result = await session.stream(text(f"""
+            SELECT created_at, acustic FROM measurement
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at
+        """), params)
+        async for chunk in result.partitions(SERIES_CHUNK_SIZE):
+            chunk_created_at, chunk_acustic = zip(*chunk)
+            created_at.append(np.array(chunk_created_at, dtype="datetime64[us]"))
+            acustic.append(np.array(chunk_acustic, dtype=np.int64))
+
+        # Archived rows come before the database rows, so only then the series needs sorting
+        created_at, acustic, total = await asyncio.to_thread(
+            downsample_chunks, created_at, acustic, points, method, archived.num_rows > 0
+        )
+        return {
+            "config_id": config_id,
+            "method": method,
+            "total": total,
+            "created_at": np.datetime_as_string(created_at).tolist(),
+            "acustic": acustic.tolist()
+        }
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.get("/edge/status", status_code=status.HTTP_200_OK)
+async def edge_status():
+    """
+    Report the state of the edge store-and-forward journal.
+    
+    Returns:
+        dict: Forwarded row counts, throughput of the last batch, the number and age
+              of rows still waiting to be forwarded to the central database, and the
+              number of rows moved to the dead letters.
+              
+    Raises:
+        HTTPException: 404 if the API is not running in edge mode.
+    """
+    if not EDGE_MODE:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"status": "error", "message": "Edge mode is not enabled"}
+        )
+    try:
+        return {"status": "ok", "edge": await forwarder_status(get_journal())}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.get("/debug/profile", status_code=status.HTTP_200_OK)
+async def debug_profile(
+    seconds: Annotated[float, Query(gt=0, le=PROFILING_MAX_SECONDS)] = 10,
+    x_profile: Annotated[str | None, Header()] = None
+):
+    """
+    Sample the whole process for a fixed time and return the call tree.
+    
+    Requests handled by other clients while sampling show up in the profile.
+    
+    Args:
+        seconds (float, optional): How long to sample. Defaults to 10.
+        x_profile (str): The X-Profile header, which must match PROFILING_TOKEN.
+        
+    Returns:
+        PlainTextResponse: The sampled call tree as text.
+        
+    Raises:
+        HTTPException: 404 if profiling is not configured or the token does not match.
+    """
+    if not profiling_authorized(x_profile):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"status": "error", "message": "Not Found"}
+        )
+    return PlainTextResponse(await profile_process(seconds))
@@ -0,0 +1,167 @@
+"""
+On-demand profiling of live requests.
+
+A request is profiled when PROFILING_ENABLED is set, or when it carries an
+`X-Profile` header equal to PROFILING_TOKEN. For a profiled request a sampling
+call tree (pyinstrument), the peak of traced memory while it ran and the allocations
+it left behind compared to its start (tracemalloc) are written to a report in PROFILING_DIR, whose file name is returned in the
+`X-Profile-Report` response header.
+
+profile_process() samples the whole event loop for a fixed time instead, which
+shows where time goes across all requests handled meanwhile.
+
+tracemalloc is process wide, so the figures of a request profiled while other
+requests run include theirs as well.
+"""
+import asyncio
+import hmac
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from uuid import uuid4
+
+import anyio
+from pyinstrument import Profiler
+
+from settings import PROFILING_ENABLED, PROFILING_TOKEN, PROFILING_DIR, PROFILING_INTERVAL
+
+PROFILE_HEADER = "x-profile"
+REPORT_HEADER = "x-profile-report"
+TOP_ALLOCATIONS = 25
+
+# Number of profiled requests in flight, tracemalloc runs while it is above zero
+_active_profiles = 0
+
+
+def profiling_authorized(token: str | None) -> bool:
+    """
+    Check a profiling token sent by a client.
+
+    Args:
+        token (str, optional): The value of the X-Profile header.
+
+    Returns:
+        bool: True if a profiling token is configured and the given token matches it.
+    """
+    return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def format_allocations(snapshot: tracemalloc.Snapshot, baseline: tracemalloc.Snapshot, peak: int,
+                       limit: int = TOP_ALLOCATIONS) -> str:
+    """
+    Format the allocation sites that grew the most between two tracemalloc snapshots.
+
+    Args:
+        snapshot (tracemalloc.Snapshot): The snapshot taken at the end.
+        baseline (tracemalloc.Snapshot): The snapshot taken at the start.
+        peak (int): The peak of traced memory in bytes in between.
+        limit (int): The number of allocation sites to list.
+
+    Returns:
+        str: One line per allocation site, largest growth first, preceded by the totals.
+    """
+    statistics = snapshot.compare_to(baseline, "lineno")
+    total = sum(statistic.size_diff for statistic in statistics)
+    blocks = sum(statistic.count_diff for statistic in statistics)
+    lines = [
+        f"Peak traced memory: {peak / 1024:.1f} KiB",
+        f"Allocated: {total / 1024:+.1f} KiB in {blocks:+d} blocks",
+    ]
+    lines += [str(statistic) for statistic in statistics[:limit]]
+    return "\n".join(lines)
+
+
+def write_report(name: str, content: str, profiling_dir: str = PROFILING_DIR) -> str:
+    """
+    Write a profiling report to the profiling directory.
+
+    Returns:
+        str: The path of the written report.
+    """
+    os.makedirs(profiling_dir, exist_ok=True)
+    path = os.path.join(profiling_dir, name)
+    with open(path, "w") as report:
+        report.write(content)
+    return path
+
+
+async def profile_process(seconds: float, interval: float = PROFILING_INTERVAL) -> str:
+    """
+    Sample everything running on the event loop for a fixed time.
+
+    Args:
+        seconds (float): How long to sample.
+        interval (float): The sampling interval in seconds.
+
+    Returns:
+        str: The call tree as text.
+    """
+    profiler = Profiler(interval=interval, async_mode="disabled")
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    return profiler.output_text(unicode=True, color=False, show_all=False)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware writing a call tree and allocation report for selected requests.
+
+    Requests to /debug/ are never profiled by the middleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def should_profile(self, scope) -> bool:
+        if scope["type"] != "http" or scope["path"].startswith("/debug/"):
+            return False
+        if PROFILING_ENABLED:
+            return True
+        headers = dict(scope["headers"])
+        token = headers.get(PROFILE_HEADER.encode())
+        return profiling_authorized(token.decode("latin-1") if token is not None else None)
+
+    async def __call__(self, scope, receive, send):
+        if not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"].strip("/").replace("/", "_") or "root"
+        name = f"{datetime.now():%Y%m%d-%H%M%S}-{scope['method']}-{path}-{uuid4().hex[:8]}.txt"
+
+        async def send_with_report_header(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (REPORT_HEADER.encode(), name.encode())]}
+            await send(message)
+
+        global _active_profiles
+        _active_profiles += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        not_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        baseline = tracemalloc.take_snapshot().filter_traces(not_tracemalloc)
+        profiler = Profiler(interval=PROFILING_INTERVAL, async_mode="enabled")
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_report_header)
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(not_tracemalloc)
+            _active_profiles -= 1
+            if not _active_profiles:
+                tracemalloc.stop()
+            report = "\n\n".join([
+                f"{scope['method']} {scope['path']} took {elapsed * 1000:.1f} ms",
+                profiler.output_text(unicode=True, color=False),
+                format_allocations(snapshot, baseline, peak),
+            ])
+            with anyio.CancelScope(shield=True):
+                await asyncio.to_thread(write_report, name, report, PROFILING_DIR)
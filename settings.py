@@ -16,3 +16,55 @@ DATABASE_URL: str = os.getenv("DATABASE_URL", "postgresql+asyncpg://user:passwor
 # Example:
 # API_KEY: Optional[str] = os.getenv("API_KEY")
 # DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
+
+# Cold-data tiering
+# Measurements older than ARCHIVE_AFTER_DAYS are moved out of PostgreSQL into
+# date-partitioned Parquet files under ARCHIVE_DIR, ARCHIVE_BATCH_SIZE rows at a time
+ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Edge store-and-forward mode
+# When EDGE_MODE is enabled, POST /measurements and POST /config are written to a local
+# SQLite journal at EDGE_JOURNAL_PATH and forwarded to DATABASE_URL in the background,
+# EDGE_FORWARD_BATCH_SIZE rows at a time every EDGE_FORWARD_INTERVAL seconds;
+# forwarded measurements are removed from the journal EDGE_JOURNAL_RETENTION_SECONDS
+# after they were created
+EDGE_MODE: bool = os.getenv("EDGE_MODE", "False").lower() == "true"
+EDGE_JOURNAL_PATH: str = os.getenv("EDGE_JOURNAL_PATH", "edge_journal.sqlite3")
+EDGE_FORWARD_BATCH_SIZE: int = int(os.getenv("EDGE_FORWARD_BATCH_SIZE", "500"))
+EDGE_FORWARD_INTERVAL: float = float(os.getenv("EDGE_FORWARD_INTERVAL", "5"))
+EDGE_JOURNAL_RETENTION_SECONDS: float = float(os.getenv("EDGE_JOURNAL_RETENTION_SECONDS", "0"))
+
+# Arrow IPC responses
+# Number of database rows fetched per chunk and sent as one Arrow record batch
+ARROW_BATCH_SIZE: int = int(os.getenv("ARROW_BATCH_SIZE", "10000"))
+
+# Batch lookups
+# Maximum number of ids accepted by the /measurements/by-ids and /config/by-ids endpoints
+MAX_BATCH_IDS: int = int(os.getenv("MAX_BATCH_IDS", "1000"))
+
+# Plot-ready series
+# Default and maximum number of points returned by /measurement/config/{config_id}/series,
+# and the number of rows fetched from the database per chunk while building the series
+SERIES_DEFAULT_POINTS: int = int(os.getenv("SERIES_DEFAULT_POINTS", "1000"))
+SERIES_MAX_POINTS: int = int(os.getenv("SERIES_MAX_POINTS", "10000"))
+SERIES_CHUNK_SIZE: int = int(os.getenv("SERIES_CHUNK_SIZE", "50000"))
+
+# Statement timeouts
+# Default PostgreSQL statement_timeout in milliseconds for request sessions (0 disables it),
+# with per-endpoint overrides given as e.g. "read_measurements=60000,read_measurement_series=120000"
+STATEMENT_TIMEOUT_MS: int = int(os.getenv("STATEMENT_TIMEOUT_MS", "30000"))
+STATEMENT_TIMEOUTS_MS: dict[str, int] = {
+    endpoint.strip(): int(timeout)
+    for endpoint, timeout in (item.split("=") for item in os.getenv("STATEMENT_TIMEOUTS_MS", "").split(",") if item)
+}
+
+# Profiling
+# Requests sent with an `X-Profile: <PROFILING_TOKEN>` header are profiled and GET /debug/profile
+# is available; PROFILING_ENABLED profiles every request. Reports are written to PROFILING_DIR
+PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+PROFILING_TOKEN: str = os.getenv("PROFILING_TOKEN", "")
+PROFILING_DIR: str = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_INTERVAL: float = float(os.getenv("PROFILING_INTERVAL", "0.001"))
+PROFILING_MAX_SECONDS: float = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
@@ -1,9 +1,17 @@
 import os
+import asyncio
 import httpx
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
 from unittest.mock import AsyncMock, MagicMock
 from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from main import (
     app,
     select_demo,
@@ -13,7 +21,30 @@ from main import (
     create_measurement,
     ConfigCreateRequest,
     read_measurement_by_id,
+    read_measurement_by_config_id,
     get_db_session,
+    get_engine,
+    dispose_engine,
+)
+from archive import (
+    archive_measurements,
+    write_archive_batch,
+    read_archived_measurement_by_id,
+    read_archived_measurements_by_ids,
+    read_archived_measurements_by_config_id,
+    load_archived_snapshots,
+    read_archived_series,
+)
+from cancellation import CancelOnDisconnectMiddleware, statement_timeout_for, with_statement_timeout
+from downsampling import downsample_chunks, lttb, minmax
+from edge import (
+    open_journal,
+    close_journal,
+    journal_measurement,
+    forward_measurements,
+    forward_once,
+    forwarder_status,
+    prune_journal,
 )
 
 integration = pytest.mark.skipif(
@@ -315,3 +346,590 @@ async def test_read_measurement_by_id():
     assert isinstance(result, JSONResponse)
     assert result.status_code == 500
     assert result.body.decode() == '{"status":"error","message":"DB Error"}'
+
+@pytest.mark.asyncio
+async def test_archive_measurements(tmp_path):
+    created_at = datetime(2024, 1, 1, 12, 0)
+    mock_session = AsyncMock()
+    mock_select_result = MagicMock()
+    mock_select_result.fetchall.return_value = [
+        MagicMock(_mapping={"id": 1, "client_id": "client-1", "snapshot_rgb_camera": "rgb1", "snapshot_hsi_camera": None, "acustic": 10, "config_id": 1, "created_at": created_at}),
+        MagicMock(_mapping={"id": 2, "client_id": None, "snapshot_rgb_camera": None, "snapshot_hsi_camera": "hsi2", "acustic": 20, "config_id": 2, "created_at": created_at}),
+    ]
+    mock_empty_result = MagicMock()
+    mock_empty_result.fetchall.return_value = []
+    mock_session.execute.side_effect = [mock_select_result, MagicMock(), mock_empty_result]
+
+    archived = await archive_measurements(mock_session, archive_dir=str(tmp_path), batch_size=2)
+
+    assert archived == 2
+    assert mock_session.execute.call_args_list[1].args[1] == {"ids": [1, 2]}
+    mock_session.commit.assert_called_once()
+    assert (tmp_path / "measurement" / "created_date=2024-01-01" / "part-1-2.parquet").exists()
+    assert (tmp_path / "snapshots" / "1_rgb.b64").read_text() == "rgb1"
+
+    measurement = read_archived_measurement_by_id(1, archive_dir=str(tmp_path))
+    assert measurement["snapshot_rgb_camera"] == "rgb1"
+    assert measurement["created_at"] == created_at
+    assert measurement["client_id"] == "client-1"
+    assert read_archived_measurement_by_id(3, archive_dir=str(tmp_path)) is None
+    assert [m["id"] for m in read_archived_measurements_by_ids([2, 3, 1], archive_dir=str(tmp_path))] == [1, 2]
+
+    measurements = read_archived_measurements_by_config_id(2, archive_dir=str(tmp_path))
+    assert [m["id"] for m in measurements] == [2]
+    assert measurements[0]["snapshot_hsi_camera"] == "hsi2"
+    assert read_archived_measurements_by_config_id(2, created_before=created_at, archive_dir=str(tmp_path)) == []
+    measurements = read_archived_measurements_by_config_id(2, archive_dir=str(tmp_path), with_snapshots=False)
+    assert measurements[0]["snapshot_hsi_camera"] == os.path.join("snapshots", "2_hsi.b64")
+    assert load_archived_snapshots(measurements, archive_dir=str(tmp_path))[0]["snapshot_hsi_camera"] == "hsi2"
+
+    series = read_archived_series(1, created_from=created_at, archive_dir=str(tmp_path))
+    assert series.column_names == ["created_at", "acustic"]
+    assert series.column("acustic").to_pylist() == [10]
+
+@pytest.mark.asyncio
+async def test_read_measurement_by_config_id_recent_archive(tmp_path, monkeypatch):
+    # Archived with a shorter age than ARCHIVE_AFTER_DAYS, e.g. before the setting was raised
+    created_at = datetime.now() - timedelta(days=10)
+    write_archive_batch([{
+        "id": 1, "client_id": None, "snapshot_rgb_camera": "rgb1", "snapshot_hsi_camera": None,
+        "acustic": 10, "config_id": 1, "created_at": created_at,
+    }], archive_dir=str(tmp_path))
+    monkeypatch.setattr("main.read_archived_measurements_by_config_id",
+                        partial(read_archived_measurements_by_config_id, archive_dir=str(tmp_path)))
+    monkeypatch.setattr("main.load_archived_snapshots", partial(load_archived_snapshots, archive_dir=str(tmp_path)))
+    mock_session = AsyncMock()
+    mock_result = MagicMock()
+    mock_result.fetchall.return_value = []
+    mock_session.execute.return_value = mock_result
+
+    result = await read_measurement_by_config_id(1, mock_session)
+    assert [(m["id"], m["snapshot_rgb_camera"]) for m in result["measurement"]] == [(1, "rgb1")]
+
+def test_archive_id_lookup_prunes_files(tmp_path, monkeypatch):
+    created_at = datetime(2024, 1, 1, 12, 0)
+    for ids in ([1, 2], [10, 11]):
+        write_archive_batch([{
+            "id": measurement_id, "client_id": None, "snapshot_rgb_camera": None, "snapshot_hsi_camera": None,
+            "acustic": 10, "config_id": 1, "created_at": created_at,
+        } for measurement_id in ids], archive_dir=str(tmp_path))
+    sources = []
+    dataset = ds.dataset
+    monkeypatch.setattr("archive.ds.dataset", lambda source, **kwargs: sources.append(source) or dataset(source, **kwargs))
+
+    assert read_archived_measurement_by_id(5, archive_dir=str(tmp_path)) is None
+    assert sources == []
+    measurement = read_archived_measurement_by_id(10, archive_dir=str(tmp_path))
+    assert measurement["id"] == 10
+    assert measurement["created_at"] == created_at
+    assert [os.path.basename(path) for path in sources[0]] == ["part-10-11.parquet"]
+    assert [m["id"] for m in read_archived_measurements_by_ids([2, 5, 11], archive_dir=str(tmp_path))] == [2, 11]
+
+def test_write_archive_batch_atomic(tmp_path, monkeypatch):
+    created_at = datetime(2024, 1, 1, 12, 0)
+    rows = [{"id": 1, "client_id": None, "snapshot_rgb_camera": "rgb1", "snapshot_hsi_camera": None,
+             "acustic": 10, "config_id": 1, "created_at": created_at}]
+
+    def failing_write_table(table, path):
+        with open(path, "wb") as partial:
+            partial.write(b"PAR1")
+        raise OSError("disk full")
+
+    monkeypatch.setattr("archive.pq.write_table", failing_write_table)
+    with pytest.raises(OSError):
+        write_archive_batch(rows, archive_dir=str(tmp_path))
+    assert os.listdir(tmp_path / "measurement" / "created_date=2024-01-01") == []
+    assert os.listdir(tmp_path / "snapshots") == ["1_rgb.b64"]
+
+@pytest.mark.asyncio
+async def test_read_measurement_archive_fallback(monkeypatch):
+    mock_session = AsyncMock()
+    mock_result = MagicMock()
+    mock_result.fetchone.return_value = None
+    mock_result.fetchall.return_value = [MagicMock(_mapping={"id": 2, "config_id": 1})]
+    mock_session.execute.return_value = mock_result
+
+    monkeypatch.setattr("main.read_archived_measurement_by_id", lambda measurement_id: {"id": measurement_id})
+    monkeypatch.setattr("main.read_archived_measurements_by_config_id", lambda config_id, **kwargs: [
+        {"id": 1, "config_id": config_id, "snapshot_rgb_camera": None, "snapshot_hsi_camera": None},
+        # Archived by a batch whose DELETE failed, the database row wins
+        {"id": 2, "config_id": config_id, "snapshot_rgb_camera": None, "snapshot_hsi_camera": None},
+    ])
+
+    result = await read_measurement_by_id(1, mock_session)
+    assert result["measurement"]["id"] == 1
+
+    result = await read_measurement_by_config_id(1, mock_session)
+    assert [m["id"] for m in result["measurement"]] == [1, 2]
+
+    monkeypatch.setattr("main.read_archived_measurement_by_id", lambda measurement_id: None)
+    result = await read_measurement_by_id(1, mock_session)
+    assert isinstance(result, JSONResponse)
+    assert result.status_code == 404
+
+@pytest.mark.asyncio
+async def test_edge_create_and_forward(tmp_path, monkeypatch):
+    journal = await open_journal(str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr("main.EDGE_MODE", True)
+    try:
+        mock_session = AsyncMock()
+        payload = ConfigCreateRequest(interval_value=100, rgb_camera=True, client_id="config-1")
+        result = await create_config(payload, mock_session)
+        assert result["config"][0]["id"] is None
+        assert result["config"][0]["rgb_camera"] is True
+
+        result = await create_measurement(acustic=50, client_id="measurement-1", config_client_id="config-1", session=mock_session)
+        assert result["measurement"][0]["client_id"] == "measurement-1"
+        # A retried write with the same client id is stored only once
+        await create_measurement(acustic=50, client_id="measurement-1", config_client_id="config-1", session=mock_session)
+        await journal_measurement(journal, "measurement-2", None, None, 60, 7, None, datetime.now())
+        mock_session.execute.assert_not_called()
+
+        status = await forwarder_status(journal)
+        assert status["pending"]["config"]["count"] == 1
+        assert status["pending"]["measurement"]["count"] == 2
+
+        mock_config_ids = MagicMock()
+        mock_config_ids.fetchall.return_value = [(42, "config-1")]
+        mock_session.execute.side_effect = [MagicMock(), mock_config_ids, MagicMock()]
+        assert await forward_once(journal, mock_session) == 3
+
+        measurements = mock_session.execute.call_args_list[2].args[1]
+        assert [m["config_id"] for m in measurements] == [42, 7]
+        assert mock_session.commit.call_count == 2
+
+        status = await forwarder_status(journal)
+        assert status["pending"]["measurement"]["count"] == 0
+        assert status["forwarded"] == {"config": 1, "measurement": 2}
+        assert await forward_once(journal, mock_session) == 0
+    finally:
+        await close_journal()
+
+@pytest.mark.asyncio
+async def test_edge_unknown_config_client_id(tmp_path, monkeypatch):
+    journal = await open_journal(str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr("main.EDGE_MODE", True)
+    try:
+        result = await create_measurement(acustic=50, client_id="measurement-1", config_client_id="missing", session=AsyncMock())
+        assert isinstance(result, JSONResponse)
+        assert result.status_code == 422
+        assert (await forwarder_status(journal))["pending"]["measurement"]["count"] == 0
+    finally:
+        await close_journal()
+
+@pytest.mark.asyncio
+async def test_edge_prune_journal(tmp_path):
+    journal = await open_journal(str(tmp_path / "journal.sqlite3"))
+    try:
+        await journal_measurement(journal, "measurement-1", None, None, 10, None, None, datetime(2024, 1, 1))
+        await journal_measurement(journal, "measurement-2", None, None, 20, None, None, datetime.now())
+        assert await forward_measurements(journal, AsyncMock(), retention_seconds=3600) == 2
+        cursor = await journal.execute("SELECT client_id FROM measurement_journal")
+        assert [row["client_id"] for row in await cursor.fetchall()] == ["measurement-2"]
+
+        await journal_measurement(journal, "measurement-3", None, None, 30, None, None, datetime.now())
+        # Rows that have not been forwarded yet are never pruned
+        assert await prune_journal(journal, 0) == 1
+        cursor = await journal.execute("SELECT client_id FROM measurement_journal")
+        assert [row["client_id"] for row in await cursor.fetchall()] == ["measurement-3"]
+    finally:
+        await close_journal()
+
+@pytest.mark.asyncio
+async def test_edge_dead_letter(tmp_path):
+    journal = await open_journal(str(tmp_path / "journal.sqlite3"))
+    try:
+        for client_id, config_id in [("measurement-1", 1), ("measurement-2", 999), ("measurement-3", 2)]:
+            await journal_measurement(journal, client_id, None, None, 10, config_id, None, datetime.now())
+
+        integrity_error = IntegrityError("INSERT", {}, Exception("violates foreign key constraint"))
+        mock_session = AsyncMock()
+        mock_session.begin_nested = MagicMock()
+        mock_session.begin_nested.return_value.__aexit__.return_value = False
+        # The batch insert fails, then each row is retried on its own
+        mock_session.execute.side_effect = [integrity_error, MagicMock(), integrity_error, MagicMock()]
+        assert await forward_measurements(journal, mock_session) == 2
+        mock_session.rollback.assert_called_once()
+        mock_session.commit.assert_called_once()
+
+        status = await forwarder_status(journal)
+        assert status["pending"]["measurement"]["count"] == 0
+        assert status["dead_letters"] == {"config": 0, "measurement": 1}
+        cursor = await journal.execute("SELECT client_id, error FROM dead_letter")
+        dead_letter = await cursor.fetchone()
+        assert dead_letter["client_id"] == "measurement-2"
+        assert "foreign key" in dead_letter["error"]
+    finally:
+        await close_journal()
+
+@pytest.mark.asyncio
+async def test_read_measurements_arrow(monkeypatch):
+    created_at = datetime(2024, 1, 1, 12, 0)
+    chunks = [
+        [(1, None, "rgb1", None, 10, 1, created_at), (2, None, None, None, 20, 1, created_at)],
+        [(3, "client-3", None, "hsi3", 30, 2, created_at)],
+    ]
+
+    async def partitions(size):
+        for chunk in chunks:
+            yield chunk
+
+    mock_stream_session = AsyncMock()
+    mock_stream_result = MagicMock()
+    mock_stream_result.partitions = partitions
+    mock_stream_session.stream.return_value = mock_stream_result
+    monkeypatch.setattr("main.open_session", lambda endpoint: mock_stream_session)
+    app.dependency_overrides[get_db_session] = lambda: AsyncMock()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/measurements", headers={"Accept": "application/vnd.apache.arrow.stream"})
+    app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 3
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.column("snapshot_hsi_camera").to_pylist() == [None, None, "hsi3"]
+    mock_stream_session.close.assert_called_once()
+
+    chunks.clear()
+    monkeypatch.setattr("main.read_archived_measurements_by_config_id", lambda config_id, **kwargs: [])
+    result = await read_measurement_by_config_id(1, AsyncMock(), accept="application/vnd.apache.arrow.stream")
+    assert isinstance(result, JSONResponse)
+    assert result.status_code == 404
+
+    # Archived rows still in the database are skipped and snapshots are loaded per batch
+    chunks.append([(2, None, None, None, 20, 1, created_at)])
+    monkeypatch.setattr("main.read_archived_measurements_by_config_id", lambda config_id, **kwargs: [
+        {"id": 1, "client_id": None, "snapshot_rgb_camera": "snapshots/1_rgb.b64", "snapshot_hsi_camera": None,
+         "acustic": 10, "config_id": 1, "created_at": created_at},
+        {"id": 2, "client_id": None, "snapshot_rgb_camera": None, "snapshot_hsi_camera": None,
+         "acustic": 20, "config_id": 1, "created_at": created_at},
+    ])
+    loaded = []
+
+    def load_snapshots(rows):
+        loaded.extend(row["id"] for row in rows)
+        return [{**row, "snapshot_rgb_camera": row["snapshot_rgb_camera"] and "rgb1"} for row in rows]
+
+    monkeypatch.setattr("main.load_archived_snapshots", load_snapshots)
+    mock_session = AsyncMock()
+    mock_live_ids = MagicMock()
+    mock_live_ids.scalars.return_value.all.return_value = [2]
+    mock_session.execute.return_value = mock_live_ids
+    result = await read_measurement_by_config_id(1, mock_session, accept="application/vnd.apache.arrow.stream")
+    body = b"".join([chunk async for chunk in result.body_iterator])
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.column("id").to_pylist() == [1, 2]
+    assert table.column("snapshot_rgb_camera").to_pylist() == ["rgb1", None]
+    assert loaded == [1]
+
+@pytest.mark.asyncio
+async def test_read_by_ids(monkeypatch):
+    mock_session = AsyncMock()
+    mock_result = MagicMock()
+    mock_result.fetchall.return_value = [
+        MagicMock(_mapping={"id": 1, "acustic": 10}),
+        MagicMock(_mapping={"id": 3, "acustic": 30}),
+    ]
+    mock_session.execute.return_value = mock_result
+    monkeypatch.setattr("main.read_archived_measurements_by_ids", lambda ids: [{"id": 2, "acustic": 20}] if 2 in ids else [])
+    app.dependency_overrides[get_db_session] = lambda: mock_session
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/measurements/by-ids", params={"ids": ["3,2", "4", "1", "3"]})
+        assert response.status_code == 200
+        assert [m["id"] for m in response.json()["measurements"]] == [3, 2, 1]
+        assert response.json()["missing"] == [4]
+        assert mock_session.execute.call_count == 1
+        assert mock_session.execute.call_args.args[1] == {"ids": [3, 2, 4, 1]}
+
+        response = await client.post("/config/by-ids", json={"ids": [3, 5, 1]})
+        assert response.status_code == 200
+        assert [c["id"] for c in response.json()["config"]] == [3, 1]
+        assert response.json()["missing"] == [5]
+
+        response = await client.get("/config/by-ids", params={"ids": "1,x"})
+        assert response.status_code == 422
+
+        monkeypatch.setattr("main.MAX_BATCH_IDS", 2)
+        response = await client.post("/measurements/by-ids", json={"ids": [1, 2, 3]})
+        assert response.status_code == 422
+        # Duplicates count towards the limit
+        response = await client.get("/measurements/by-ids", params={"ids": "1,1,1"})
+        assert response.status_code == 422
+        response = await client.post("/measurements/by-ids", json={"ids": [1, 1, 1]})
+        assert response.status_code == 422
+        assert response.json() == {"status": "error", "message": "At most 2 ids can be requested at once"}
+
+        mock_session.execute.side_effect = Exception("DB Error")
+        response = await client.get("/config/by-ids", params={"ids": "1"})
+        assert response.status_code == 500
+        assert response.json() == {"status": "error", "message": "DB Error"}
+
+    app.dependency_overrides.clear()
+
+def test_downsampling():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[500] = 10
+
+    selected = lttb(x, y, 50)
+    assert len(selected) == 50
+    assert selected[0] == 0 and selected[-1] == 999
+    assert np.all(np.diff(selected) > 0)
+    assert 500 in selected
+
+    selected = minmax(y, 50)
+    assert len(selected) <= 50
+    assert np.all(np.diff(selected) > 0)
+    assert 500 in selected
+    assert np.argmin(y) in selected
+
+    assert len(lttb(x[:10], y[:10], 50)) == 10
+
+    timestamps = np.datetime64("2024-01-01") + np.arange(6).astype("timedelta64[s]")
+    created_at, values, total = downsample_chunks(
+        [timestamps[3:], timestamps[:3]], [np.array([3, 4, 5]), np.array([0, 1, 2])], 3, "lttb", sort=True
+    )
+    assert total == 6
+    assert created_at[0] == timestamps[0] and created_at[-1] == timestamps[-1]
+    assert values.tolist()[0] == 0 and values.tolist()[-1] == 5
+
+@pytest.mark.asyncio
+async def test_read_measurement_series(monkeypatch):
+    start = np.datetime64("2024-01-01T00:00:00", "us")
+    created_at = (start + np.arange(100) * np.timedelta64(1, "m")).astype(object)
+    chunks = [list(zip(created_at[:60], range(60))), list(zip(created_at[60:], range(60, 100)))]
+
+    async def partitions(size):
+        for chunk in chunks:
+            yield chunk
+
+    mock_session = AsyncMock()
+    mock_result = MagicMock()
+    mock_result.partitions = partitions
+    mock_session.stream.return_value = mock_result
+    monkeypatch.setattr("main.read_archived_series", lambda config_id, created_from, created_before: pa.table({
+        "created_at": pa.array([], type=pa.timestamp("us")),
+        "acustic": pa.array([], type=pa.int64()),
+    }))
+    app.dependency_overrides[get_db_session] = lambda: mock_session
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/measurement/config/1/series", params={"points": 10, "from": "2024-01-01T00:00:00"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 100
+        assert len(data["created_at"]) == len(data["acustic"]) == 10
+        assert data["created_at"][0] == "2024-01-01T00:00:00.000000"
+        assert data["acustic"][-1] == 99
+        assert mock_session.stream.call_args.args[1] == {"config_id": 1, "from": datetime(2024, 1, 1)}
+
+        response = await client.get("/measurement/config/1/series", params={"points": 1})
+        assert response.status_code == 422
+
+    app.dependency_overrides.clear()
+
+@pytest.mark.asyncio
+async def test_read_measurements_expand_config():
+    mock_session = AsyncMock()
+    mock_measurements_result = MagicMock()
+    mock_measurements_result.fetchall.return_value = [
+        MagicMock(_mapping={"id": 1, "config_id": 1}),
+        MagicMock(_mapping={"id": 2, "config_id": 2}),
+        MagicMock(_mapping={"id": 3, "config_id": 1}),
+        MagicMock(_mapping={"id": 4, "config_id": None}),
+    ]
+    mock_configs_result = MagicMock()
+    mock_configs_result.fetchall.return_value = [
+        MagicMock(_mapping={"id": 1, "interval_value": 100}),
+        MagicMock(_mapping={"id": 2, "interval_value": 200}),
+    ]
+    mock_session.execute.side_effect = [mock_measurements_result, mock_configs_result]
+    app.dependency_overrides[get_db_session] = lambda: mock_session
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/measurements", params={"expand": "config"})
+        assert response.status_code == 200
+        measurements = response.json()["measurements"]
+        assert [m["config"]["interval_value"] if m["config"] else None for m in measurements] == [100, 200, 100, None]
+        assert mock_session.execute.call_count == 2
+        assert mock_session.execute.call_args.args[1] == {"ids": [1, 2]}
+
+        response = await client.get("/measurements", params={"expand": "unknown"})
+        assert response.status_code == 422
+
+    app.dependency_overrides.clear()
+
+    mock_session = AsyncMock()
+    mock_result = MagicMock()
+    mock_result.fetchone.return_value = MagicMock(_mapping={"id": 1, "config_id": 1, "config": {"id": 1, "interval_value": 100}})
+    mock_session.execute.return_value = mock_result
+
+    result = await read_measurement_by_id(1, mock_session, expand="config")
+    assert result["measurement"]["config"]["interval_value"] == 100
+    mock_session.execute.assert_called_once()
+    assert "LEFT JOIN config" in str(mock_session.execute.call_args.args[0])
+
+def test_statement_timeout(monkeypatch):
+    monkeypatch.setattr("cancellation.STATEMENT_TIMEOUT_MS", 30000)
+    monkeypatch.setattr("cancellation.STATEMENT_TIMEOUTS_MS", {"read_measurements": 5000})
+    assert statement_timeout_for("read_measurements") == 5000
+    assert statement_timeout_for("read_config") == 30000
+
+    session = with_statement_timeout(AsyncSession(), 5000)
+    mock_connection = MagicMock()
+    session.sync_session.dispatch.after_begin(session.sync_session, MagicMock(), mock_connection)
+    mock_connection.exec_driver_sql.assert_called_once_with("SET LOCAL statement_timeout = 5000")
+
+    session = with_statement_timeout(AsyncSession(), 0)
+    mock_connection = MagicMock()
+    session.sync_session.dispatch.after_begin(session.sync_session, MagicMock(), mock_connection)
+    mock_connection.exec_driver_sql.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_shared_engine(monkeypatch):
+    create_engine = MagicMock(side_effect=lambda *args, **kwargs: AsyncMock())
+    monkeypatch.setattr("main.create_async_engine", create_engine)
+    monkeypatch.setattr("main._engine", None)
+
+    engine = get_engine()
+    assert get_engine() is engine
+    create_engine.assert_called_once()
+    await dispose_engine()
+    engine.dispose.assert_awaited_once()
+    assert get_engine() is not engine
+    await dispose_engine()
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect_reraises_app_error():
+    async def failing_app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    middleware = CancelOnDisconnectMiddleware(failing_app)
+    with pytest.raises(RuntimeError, match="boom"):
+        await middleware({"type": "http", "method": "GET"}, receive, AsyncMock())
+
+@pytest.mark.asyncio
+async def test_cancel_query_on_disconnect(monkeypatch):
+    query_started = asyncio.Event()
+    query_cancelled = asyncio.Event()
+
+    async def slow_execute(*args, **kwargs):
+        query_started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            query_cancelled.set()
+            raise
+
+    mock_session = AsyncMock()
+    mock_session.execute.side_effect = slow_execute
+    endpoints = []
+    monkeypatch.setattr("main.open_session", lambda endpoint: endpoints.append(endpoint) or mock_session)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/measurements",
+        "raw_path": b"/measurements",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("client", 1234),
+        "server": ("test", 80),
+    }
+    messages = asyncio.Queue()
+    await messages.put({"type": "http.request", "body": b"", "more_body": False})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    request = asyncio.create_task(app(scope, messages.get, send))
+    await asyncio.wait_for(query_started.wait(), 1)
+    # The client goes away while the query is still running
+    await messages.put({"type": "http.disconnect"})
+    await asyncio.wait_for(request, 1)
+
+    assert query_cancelled.is_set()
+    assert endpoints == ["read_measurements"]
+    mock_session.close.assert_awaited_once()
+    assert sent == []
+
+    # Completed requests are not affected by the disconnect that follows the response
+    query_started.clear()
+    mock_session.execute.side_effect = None
+    mock_result = MagicMock()
+    mock_result.fetchall.return_value = [MagicMock(_mapping={"id": 1})]
+    mock_session.execute.return_value = mock_result
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/measurements")
+    assert response.status_code == 200
+    assert response.json() == {"measurements": [{"id": 1}]}
+
+@pytest.mark.asyncio
+async def test_profiling(tmp_path, monkeypatch):
+    mock_session = AsyncMock()
+    mock_result = MagicMock()
+    mock_result.fetchall.return_value = [MagicMock(_mapping={"id": 1})]
+    mock_session.execute.return_value = mock_result
+    app.dependency_overrides[get_db_session] = lambda: mock_session
+    monkeypatch.setattr("profiling.PROFILING_TOKEN", "secret")
+    monkeypatch.setattr("profiling.PROFILING_DIR", str(tmp_path))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/measurements", headers={"X-Profile": "wrong"})
+        assert response.status_code == 200
+        assert "x-profile-report" not in response.headers
+        assert list(tmp_path.iterdir()) == []
+
+        response = await client.get("/measurements", headers={"X-Profile": "secret"})
+        assert response.status_code == 200
+        assert response.json() == {"measurements": [{"id": 1}]}
+        report = (tmp_path / response.headers["x-profile-report"]).read_text()
+        assert report.startswith("GET /measurements took")
+        assert "Peak traced memory:" in report
+        assert "Allocated:" in report
+
+        response = await client.get("/debug/profile", params={"seconds": 0.05})
+        assert response.status_code == 404
+
+        response = await client.get("/debug/profile", params={"seconds": 0.05}, headers={"X-Profile": "secret"})
+        assert response.status_code == 200
+        assert "Duration" in response.text
+
+        response = await client.get("/debug/profile", params={"seconds": 0}, headers={"X-Profile": "secret"})
+        assert response.status_code == 422
+
+    app.dependency_overrides.clear()
+
+def test_archive_mixed_schema(tmp_path):
+    created_at = datetime(2024, 1, 1, 12, 0)
+    # A partition written before client_id was part of the archive schema
+    old_partition = tmp_path / "measurement" / "created_date=2024-01-01"
+    old_partition.mkdir(parents=True)
+    pq.write_table(pa.table({
+        "id": pa.array([1], type=pa.int64()),
+        "snapshot_rgb_camera": pa.array([None], type=pa.string()),
+        "snapshot_hsi_camera": pa.array([None], type=pa.string()),
+        "acustic": pa.array([10], type=pa.int64()),
+        "config_id": pa.array([1], type=pa.int64()),
+        "created_at": pa.array([created_at], type=pa.timestamp("us")),
+    }), old_partition / "part-1-1.parquet")
+    write_archive_batch([{
+        "id": 2, "client_id": "client-2", "snapshot_rgb_camera": None, "snapshot_hsi_camera": None,
+        "acustic": 20, "config_id": 1, "created_at": created_at,
+    }], archive_dir=str(tmp_path))
+
+    measurements = read_archived_measurements_by_config_id(1, archive_dir=str(tmp_path))
+    assert [(m["id"], m["client_id"]) for m in measurements] == [(1, None), (2, "client-2")]
+    assert read_archived_measurement_by_id(1, archive_dir=str(tmp_path))["client_id"] is None